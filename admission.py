@@ -0,0 +1,206 @@
+"""
+Admission control for database-bound routes.
+
+Every route that needs a pooled connection is admitted through an
+AdmissionController before it may acquire one. The controller caps total and
+per-route concurrency, keeps a bounded priority queue of waiters, and sheds a
+request immediately when its estimated queueing delay (derived from moving
+averages of each route's recent service times) would exceed the route's
+target wait.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+
+@dataclass
+class RoutePolicy:
+    """Admission settings for one route; lower priority values are served first"""
+    limit: int
+    priority: int = 0
+    target_wait_ms: float = 250.0
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being queued"""
+
+    def __init__(self, route, reason, retry_after):
+        super().__init__(f"{route}: {reason}")
+        self.route = route
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("route", "future", "enqueued")
+
+    def __init__(self, route):
+        self.route = route
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.perf_counter()
+
+    def granted(self):
+        """Whether _wake() handed this waiter a slot (not evicted or cancelled)"""
+        future = self.future
+        return future.done() and not future.cancelled() and future.exception() is None
+
+
+class AdmissionController:
+    def __init__(self, capacity, policies, max_queue=100, smoothing=0.2):
+        self.capacity = capacity
+        self.policies = policies
+        self.max_queue = max_queue
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.route_in_flight = {route: 0 for route in policies}
+        self.service_ewma = {route: 0.0 for route in policies}
+        self._queue = []
+        self._sequence = itertools.count()
+        self.counters = {
+            route: {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0, "wait_seconds": 0.0}
+            for route in policies
+        }
+
+    def _has_room(self, route):
+        return (
+            self.in_flight < self.capacity
+            and self.route_in_flight[route] < self.policies[route].limit
+        )
+
+    def _queued(self):
+        return sum(1 for entry in self._queue if not entry[2].future.done())
+
+    def _queued_ahead(self, priority):
+        return [
+            entry[2] for entry in self._queue
+            if entry[0] <= priority and not entry[2].future.done()
+        ]
+
+    def estimated_wait(self, route):
+        """Seconds a new request for `route` would wait, given the waiters ahead of it"""
+        ahead = self._queued_ahead(self.policies[route].priority)
+        work = sum(self.service_ewma[waiter.route] for waiter in ahead) + self.service_ewma[route]
+        return work / max(self.capacity, 1)
+
+    def _grant(self, route):
+        self.in_flight += 1
+        self.route_in_flight[route] += 1
+        self.counters[route]["admitted"] += 1
+
+    def _wake(self):
+        """Hand free slots to queued waiters, highest priority first"""
+        skipped = []
+        while self._queue and self.in_flight < self.capacity:
+            entry = heapq.heappop(self._queue)
+            waiter = entry[2]
+            if waiter.future.done():
+                continue
+            if self.route_in_flight[waiter.route] >= self.policies[waiter.route].limit:
+                skipped.append(entry)
+                continue
+            self._grant(waiter.route)
+            waiter.future.set_result(True)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+
+    def _release(self, route, started=None):
+        self.in_flight -= 1
+        self.route_in_flight[route] -= 1
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            if self.service_ewma[route]:
+                self.service_ewma[route] += self.smoothing * (elapsed - self.service_ewma[route])
+            else:
+                self.service_ewma[route] = elapsed
+        self._wake()
+
+    def _evict_below(self, priority):
+        """Shed the newest waiter with a lower priority than `priority`, if any"""
+        victims = [entry for entry in self._queue if entry[0] > priority and not entry[2].future.done()]
+        if not victims:
+            return False
+        entry = max(victims, key=lambda item: (item[0], item[1]))
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        waiter = entry[2]
+        self.counters[waiter.route]["shed"] += 1
+        waiter.future.set_exception(
+            AdmissionRejected(waiter.route, "evicted by higher-priority request", 1)
+        )
+        return True
+
+    def _reject(self, route, reason, estimate):
+        self.counters[route]["shed"] += 1
+        raise AdmissionRejected(route, reason, max(1, math.ceil(estimate)))
+
+    @asynccontextmanager
+    async def admit(self, route):
+        """Hold an admission slot for `route` for the duration of the block"""
+        policy = self.policies[route]
+        ahead = self._queued_ahead(policy.priority)
+        if not ahead and self._has_room(route):
+            self._grant(route)
+        else:
+            target = policy.target_wait_ms / 1000
+            estimate = self.estimated_wait(route)
+            if self._queued() >= self.max_queue and not self._evict_below(policy.priority):
+                self._reject(route, "queue full", estimate)
+            if estimate > target:
+                self._reject(route, "estimated wait exceeds target", estimate)
+
+            waiter = _Waiter(route)
+            heapq.heappush(self._queue, (policy.priority, next(self._sequence), waiter))
+            self.counters[route]["queued"] += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=target)
+            except asyncio.TimeoutError:
+                if waiter.granted():
+                    # _wake() handed over the slot as the wait ran out; pass it on
+                    self._release(route)
+                elif waiter.future.done():
+                    # Evicted as the wait ran out
+                    raise waiter.future.exception() from None
+                waiter.future.cancel()
+                self.counters[route]["timed_out"] += 1
+                self._reject(route, "queue wait exceeded target", estimate)
+            except asyncio.CancelledError:
+                if waiter.granted():
+                    # The slot was granted just as the caller went away
+                    self._release(route)
+                else:
+                    waiter.future.cancel()
+                raise
+            finally:
+                self.counters[route]["wait_seconds"] += time.perf_counter() - waiter.enqueued
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(route, started)
+
+    def metrics(self):
+        """Snapshot of controller state and cumulative per-route counters"""
+        return {
+            "capacity": self.capacity,
+            "inFlight": self.in_flight,
+            "queued": self._queued(),
+            "maxQueue": self.max_queue,
+            "routes": {
+                route: {
+                    "limit": policy.limit,
+                    "priority": policy.priority,
+                    "targetWaitMs": policy.target_wait_ms,
+                    "inFlight": self.route_in_flight[route],
+                    "serviceTimeEwmaMs": round(self.service_ewma[route] * 1000, 3),
+                    "estimatedWaitMs": round(self.estimated_wait(route) * 1000, 3),
+                    **self.counters[route],
+                }
+                for route, policy in self.policies.items()
+            },
+        }
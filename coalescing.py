@@ -0,0 +1,88 @@
+"""
+Single-flight coalescing of identical concurrent reads.
+
+Callers that ask for the same key while a read is already in flight await the
+leader's result instead of running their own query. With a TTL, a finished
+result is also served from a small micro-cache for that many seconds. Writes
+call invalidate() so reads issued after them never join an older flight.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, ttl=0.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._flights = {}
+        self._cache = OrderedDict()
+        self.stats = {"executions": 0, "coalesced": 0, "cache_hits": 0}
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def _complete(self, key, flight, task):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+            if self.ttl and not task.cancelled() and task.exception() is None:
+                self._cache[key] = (time.monotonic() + self.ttl, task.result())
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+    async def do(self, key, fn):
+        """Return `await fn()`, sharing one execution among concurrent callers of `key`"""
+        cached = self._cached(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached[1]
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._complete(key, flight, task))
+            self.stats["executions"] += 1
+        else:
+            self.stats["coalesced"] += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            # Only abandon the shared query once nobody is waiting for it
+            if not flight.task.done() and flight.waiters == 1:
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def invalidate(self):
+        """Drop cached results and detach in-flight reads from new callers"""
+        self._cache.clear()
+        self._flights.clear()
+
+    def metrics(self):
+        return {
+            "inFlight": len(self._flights),
+            "cached": len(self._cache),
+            "ttlMs": self.ttl * 1000,
+            **self.stats,
+        }
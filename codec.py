@@ -0,0 +1,119 @@
+"""
+Optional fast JSON codec for the hot endpoints.
+
+With msgspec installed, endpoints marked with @decode_body receive their
+request body decoded straight into a msgspec Struct (constraints are checked
+while decoding), and encode() turns response payloads straight into bytes.
+This skips Pydantic model construction, response revalidation and
+jsonable_encoder. FastAPI still builds the OpenAPI schema from the Pydantic
+models declared on the endpoints, and serves every request through them when
+msgspec is missing or the codec is disabled. A body the Struct rejects also
+goes through FastAPI's Pydantic parsing, so it is accepted or rejected
+exactly as it would be without the codec.
+"""
+
+import asyncio
+import inspect
+
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+import tracing
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional dependency
+    msgspec = None
+
+available = msgspec is not None
+
+_encoder = msgspec.json.Encoder() if available else None
+
+
+def encode(payload):
+    """Serialize a JSON-compatible payload to bytes"""
+    return _encoder.encode(payload)
+
+
+def raw_json(text):
+    """Embed already-encoded JSON text (e.g. a JSONB column) verbatim in an encode() payload"""
+    return msgspec.Raw(text)
+
+
+def as_dict(value):
+    """Plain dict of a msgspec Struct or a Pydantic model"""
+    if available and isinstance(value, msgspec.Struct):
+        return msgspec.structs.asdict(value)
+    return value.model_dump() if hasattr(value, "model_dump") else value.dict()
+
+
+def decode_body(param, struct):
+    """Mark an endpoint whose `param` body may be decoded directly into `struct`.
+
+    A `struct` of None leaves the endpoint on FastAPI's regular body parsing.
+    """
+    def mark(endpoint):
+        endpoint.__body_decoder__ = (param, msgspec.json.Decoder(struct) if struct is not None else None)
+        return endpoint
+    return mark
+
+
+def run_validators(struct, validators):
+    """Apply Pydantic field validators ({field: callable}) from a Struct's __post_init__"""
+    for name, validate in validators.items():
+        setattr(struct, name, validate(getattr(struct, name)))
+
+
+class CodecRoute(APIRoute):
+    """APIRoute that bypasses FastAPI's body parsing for @decode_body endpoints.
+
+    Such endpoints may only take the request, path parameters and the body.
+    Every endpoint is wrapped with tracing.traced_endpoint.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        marker = getattr(endpoint, "__body_decoder__", None)
+        self.body_decoder = marker if marker and marker[1] is not None else None
+        # The wrapper keeps the endpoint's signature (functools.wraps), which is
+        # what FastAPI analyses, and lets tracing time the call apart from
+        # FastAPI's parsing and serialization
+        super().__init__(path, tracing.traced_endpoint(endpoint), **kwargs)
+        if self.body_decoder:
+            allowed = {"request", self.body_decoder[0], *self.param_convertors}
+            extra = set(inspect.signature(endpoint).parameters) - allowed
+            if extra:
+                raise TypeError(f"{endpoint.__name__}: fast-decoded endpoints cannot take {sorted(extra)}")
+
+    def get_route_handler(self):
+        pydantic_handler = super().get_route_handler()
+        if not self.body_decoder:
+            return pydantic_handler
+        endpoint = self.endpoint
+        param, struct_decoder = self.body_decoder
+        takes_request = "request" in inspect.signature(endpoint).parameters
+
+        async def handler(request):
+            try:
+                body = struct_decoder.decode(await request.body())
+            except msgspec.DecodeError:
+                # Pydantic is laxer than msgspec (e.g. it takes a midnight datetime
+                # for a date), so the body gets exactly the result it would get
+                # without the codec: accepted, or Pydantic's 422 errors
+                return await pydantic_handler(request)
+
+            kwargs = dict(request.path_params)
+            kwargs[param] = body
+            if takes_request:
+                kwargs["request"] = request
+            if asyncio.iscoroutinefunction(endpoint):
+                response = await endpoint(**kwargs)
+            else:
+                response = await run_in_threadpool(endpoint, **kwargs)
+            if isinstance(response, Response):
+                return response
+            return JSONResponse(jsonable_encoder(response), status_code=self.status_code or 200)
+
+        return handler
@@ -0,0 +1,266 @@
+"""
+Response compression with negotiated content codings.
+
+CompressionMiddleware compresses compressible responses with the best coding
+the client accepts: zstd and brotli when their optional packages are
+installed, otherwise gzip. Responses sent in one piece are skipped below a
+size threshold, and their compressed bytes are kept in an LRU cache keyed by
+a hash of the body, so identical pages (e.g. a list being polled) are only
+compressed once. Streamed responses are compressed chunk by chunk and
+flushed after each chunk.
+"""
+
+import hashlib
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+class _Gzip:
+    name = "gzip"
+
+    def __init__(self, level):
+        self.level = level
+
+    def _compressobj(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        compressor = self._compressobj()
+        return compressor.compress(data) + compressor.flush()
+
+    def stream(self):
+        compressor = self._compressobj()
+        return (
+            lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH),
+            compressor.flush,
+        )
+
+
+class _Brotli:
+    name = "br"
+
+    def __init__(self, quality):
+        self.quality = quality
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.quality)
+
+    def stream(self):
+        compressor = brotli.Compressor(quality=self.quality)
+        return (
+            lambda data: compressor.process(data) + compressor.flush(),
+            compressor.finish,
+        )
+
+
+class _Zstd:
+    name = "zstd"
+
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def stream(self):
+        compressor = self.compressor.compressobj()
+        return (
+            lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush,
+        )
+
+
+def parse_accept_encoding(header):
+    """{coding: q} from an Accept-Encoding header value"""
+    weights = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    return weights
+
+
+def is_compressible(content_type):
+    media_type = content_type.split(";")[0].strip().lower()
+    return (
+        media_type.startswith("text/")
+        or media_type.endswith(("/json", "+json", "/x-ndjson", "/xml", "+xml"))
+        or media_type.startswith("application/vnd.apache.arrow")
+    )
+
+
+class ResponseCompressor:
+    """Negotiates codings and keeps the precompressed-body cache and counters"""
+
+    def __init__(self, minimum_size=1024, gzip_level=6, brotli_quality=4, zstd_level=3,
+                 cache_bytes=32 * 1024 * 1024):
+        self.minimum_size = minimum_size
+        # Preferred first when the client weights codings equally
+        self.encoders = []
+        if zstandard is not None:
+            self.encoders.append(_Zstd(zstd_level))
+        if brotli is not None:
+            self.encoders.append(_Brotli(brotli_quality))
+        self.encoders.append(_Gzip(gzip_level))
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self.stats = {"compressed": 0, "streamed": 0, "skipped_small": 0, "cache_hits": 0,
+                      "bytes_in": 0, "bytes_out": 0}
+
+    def select_encoder(self, accept_encoding):
+        """Best coding the client accepts, or None for identity"""
+        weights = parse_accept_encoding(accept_encoding)
+        wildcard = weights.get("*", 0.0)
+        best, best_q = None, 0.0
+        for encoder in self.encoders:
+            q = weights.get(encoder.name, wildcard)
+            if q > best_q:
+                best, best_q = encoder, q
+        return best
+
+    def compress(self, encoder, body):
+        """Compressed `body`, served from the cache when the same bytes were compressed before"""
+        key = (encoder.name, hashlib.blake2b(body, digest_size=16).digest())
+        compressed = self._cache.get(key)
+        if compressed is not None:
+            self._cache.move_to_end(key)
+            self.stats["cache_hits"] += 1
+        else:
+            compressed = encoder.compress(body)
+            if len(compressed) <= self.cache_bytes:
+                self._cache[key] = compressed
+                self._cached_bytes += len(compressed)
+                while self._cached_bytes > self.cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= len(evicted)
+        self.stats["compressed"] += 1
+        self.stats["bytes_in"] += len(body)
+        self.stats["bytes_out"] += len(compressed)
+        return compressed
+
+    def metrics(self):
+        return {
+            "encodings": [encoder.name for encoder in self.encoders],
+            "minimumSize": self.minimum_size,
+            "cacheEntries": len(self._cache),
+            "cacheBytes": self._cached_bytes,
+            **self.stats,
+        }
+
+
+class CompressionMiddleware:
+    def __init__(self, app, compressor):
+        self.app = app
+        self.compressor = compressor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        compressor = self.compressor
+        encoder = compressor.select_encoder(accept_encoding) if accept_encoding else None
+
+        start = None
+        stream = None
+        passthrough = False
+
+        async def send_compressing(message):
+            nonlocal start, stream, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                headers = dict((name.lower(), value) for name, value in message.get("headers", []))
+                if (
+                    b"content-encoding" in headers
+                    or b"no-transform" in headers.get(b"cache-control", b"")
+                    or not is_compressible(headers.get(b"content-type", b"").decode("latin-1"))
+                ):
+                    passthrough = True
+                    await send(message)
+                elif encoder is None:
+                    passthrough = True
+                    await send(_with_headers(message, vary=True))
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if stream is None and not more_body:
+                # Whole response in one message
+                if len(body) < compressor.minimum_size:
+                    compressor.stats["skipped_small"] += 1
+                    await send(_with_headers(start, vary=True))
+                    await send(message)
+                    return
+                compressed = compressor.compress(encoder, body)
+                await send(_with_headers(start, vary=True, encoding=encoder.name, length=len(compressed)))
+                await send({"type": "http.response.body", "body": compressed})
+                return
+
+            if stream is None:
+                stream = encoder.stream()
+                compressor.stats["streamed"] += 1
+                await send(_with_headers(start, vary=True, encoding=encoder.name))
+
+            compress_chunk, finish = stream
+            compressor.stats["bytes_in"] += len(body)
+            chunk = compress_chunk(body) if body else b""
+            if not more_body:
+                chunk += finish()
+            compressor.stats["bytes_out"] += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressing)
+
+
+def _with_headers(start, vary=False, encoding=None, length=None):
+    """Copy of a response start message with Vary / Content-Encoding / Content-Length adjusted"""
+    headers = []
+    for name, value in start.get("headers", []):
+        lowered = name.lower()
+        if encoding and lowered == b"content-length":
+            continue
+        if encoding and lowered == b"etag" and not value.startswith(b"W/"):
+            # The compressed body is a different representation
+            value = b"W/" + value
+        if vary and lowered == b"vary":
+            if b"accept-encoding" not in value.lower():
+                value += b", Accept-Encoding"
+            vary = False
+        headers.append((name, value))
+    if vary:
+        headers.append((b"vary", b"Accept-Encoding"))
+    if encoding:
+        headers.append((b"content-encoding", encoding.encode("latin-1")))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode("latin-1")))
+    return {**start, "headers": headers}
@@ -1,11 +1,15 @@
 #!/bin/bash
 
-# Wait for PostgreSQL to be ready
-echo "Waiting for PostgreSQL..."
-while ! nc -z postgres 5432; do
-  sleep 1
+# Wait for PostgreSQL to be ready (DB_WAIT_HOSTS: space-separated host:port list,
+# empty to skip, e.g. with the embedded SQLite backend)
+DB_WAIT_HOSTS=${DB_WAIT_HOSTS-postgres:5432}
+for target in $DB_WAIT_HOSTS; do
+  echo "Waiting for PostgreSQL at $target..."
+  while ! nc -z "${target%:*}" "${target##*:}"; do
+    sleep 1
+  done
 done
 echo "PostgreSQL started"
 
-# Start the FastAPI app
-exec uvicorn app:app --host 0.0.0.0 --port 8000 --reload
+# Start the FastAPI app (one worker per CPU; see serve.py)
+exec python serve.py --host 0.0.0.0 --port 8000
@@ -0,0 +1,180 @@
+"""
+Columnar export of wheel_specifications as Arrow IPC or Parquet.
+
+Rows are read in batches by the storage backend (a server-side cursor on
+Postgres), and each `fields` key becomes its own typed column, extracted in
+SQL. Every batch is written as one Arrow record batch or one Parquet row
+group. Arrow and Parquet encoding runs in a worker thread,
+keeping the event loop free for other requests.
+
+HTTP exports use the Arrow IPC *stream* format, which can be produced without
+seeking. File exports use the IPC *file* format, whose footer lets readers
+memory-map it and read columns without copying:
+
+    import pyarrow as pa
+    table = pa.ipc.open_file(pa.memory_map("specs.arrow")).read_all()
+
+pyarrow is an optional dependency.
+"""
+
+import asyncio
+import os
+from datetime import date
+from typing import Optional, get_args
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pq = None
+
+available = pa is not None
+
+FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# (export column name, table column, Arrow type) of the fixed columns
+BASE_COLUMNS = [
+    ("id", "id", "int64"),
+    ("formNumber", "form_number", "string"),
+    ("submittedBy", "submitted_by", "string"),
+    ("submittedDate", "submitted_date", "date32"),
+    ("createdAt", "created_at", "timestamp"),
+    ("updatedAt", "updated_at", "timestamp"),
+]
+
+# Python annotation -> Arrow type
+_FIELD_TYPES = {
+    str: "string",
+    int: "int64",
+    float: "float64",
+    bool: "bool",
+    date: "date32",
+}
+
+
+def _arrow_type(name):
+    if name == "timestamp":
+        return pa.timestamp("us", tz="UTC")
+    return getattr(pa, name)()
+
+
+class ExportSchema:
+    """Columns of an export: the table's own columns plus one per fields key.
+
+    `base_columns` holds (name, table column, Arrow type) and `field_columns`
+    (fields key, Arrow type); storage backends select them in that order.
+    """
+
+    def __init__(self, fields_model):
+        self.base_columns = list(BASE_COLUMNS)
+        self.field_columns = []
+        for key, info in fields_model.model_fields.items():
+            annotation = info.annotation
+            # Optional[X] -> X
+            args = [arg for arg in get_args(annotation) if arg is not type(None)]
+            self.field_columns.append((key, _FIELD_TYPES.get(args[0] if args else annotation, "string")))
+
+        self.schema = pa.schema(
+            [(name, _arrow_type(arrow_type)) for name, _, arrow_type in self.base_columns]
+            + [(key, _arrow_type(arrow_type)) for key, arrow_type in self.field_columns]
+        )
+
+    def to_batch(self, rows):
+        """Record batch from a list of rows in column order"""
+        columns = list(zip(*rows)) if rows else [[] for _ in self.schema]
+        return pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema,
+        )
+
+
+class _ChunkSink:
+    """Writable file object that hands out what was written since the last take()"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _open_writer(sink, schema, format, compression, file=False):
+    if format == "parquet":
+        return pq.ParquetWriter(sink, schema, compression=compression)
+    if file:
+        return pa.ipc.new_file(sink, schema)
+    return pa.ipc.new_stream(sink, schema)
+
+
+async def stream(batches, export_schema, format, compression="zstd"):
+    """Encode row batches as an Arrow IPC stream or Parquet, yielding bytes per batch"""
+    sink = _ChunkSink()
+    writer = _open_writer(sink, export_schema.schema, format, compression)
+
+    def write(rows):
+        writer.write_batch(export_schema.to_batch(rows))
+        return sink.take()
+
+    try:
+        async for rows in batches:
+            yield await asyncio.to_thread(write, rows)
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+async def write_file(batches, export_schema, path, format, compression="zstd"):
+    """Write row batches to `path` (Arrow IPC file or Parquet); returns the row count.
+
+    The file is written next to `path` and renamed into place when complete.
+    """
+    partial = f"{path}.partial"
+    writer = await asyncio.to_thread(_open_writer, partial, export_schema.schema, format, compression, True)
+
+    def write(rows):
+        writer.write_batch(export_schema.to_batch(rows))
+
+    rows_written = 0
+    try:
+        async for rows in batches:
+            await asyncio.to_thread(write, rows)
+            rows_written += len(rows)
+    except BaseException:
+        writer.close()
+        os.remove(partial)
+        raise
+    writer.close()
+    os.replace(partial, path)
+    return rows_written
+
+
+def format_for_path(path: str) -> Optional[str]:
+    """Export format implied by a file extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    if extension in (".arrow", ".feather", ".ipc"):
+        return "arrow"
+    return None
@@ -0,0 +1,197 @@
+"""
+Background health probing with cached results.
+
+HealthProber checks every database on an interval, over its own dedicated
+connection per database, so probes never take a slot from the request pool
+and health endpoints never touch the database. Each round measures:
+
+* round-trip latency of one probe query,
+* replication lag: replay delay when the database is a standby, or the
+  largest replay_lag of its standbys when it is a primary,
+* pool saturation (connections in use / pool maximum), when the caller
+  supplies pool statistics,
+* event loop lag: how late the prober's own sleep woke up.
+
+An embedded SQLite database (a sqlite:// URL) is probed the same way over
+its own read-only connection; it has no replication lag.
+
+Results are compared with degradation thresholds and kept in memory;
+health endpoints serve the latest report as-is. A database whose probe
+fails, or whose last success is older than `stale_after`, is failing.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+OK, DEGRADED, FAILING = "ok", "degraded", "failing"
+_SEVERITY = {OK: 0, DEGRADED: 1, FAILING: 2}
+
+PROBE_QUERY = """
+    SELECT
+        pg_is_in_recovery() AS in_recovery,
+        CASE WHEN pg_is_in_recovery()
+             THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END AS replay_delay,
+        (SELECT EXTRACT(EPOCH FROM max(replay_lag)) FROM pg_stat_replication) AS standby_lag
+"""
+
+SQLITE_PROBE_QUERY = "SELECT 1 FROM wheel_specifications LIMIT 1"
+
+
+class _SQLiteProbe:
+    """Dedicated read-only connection to an embedded database, used off the event loop"""
+
+    def __init__(self, path, timeout):
+        self.conn = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, timeout=timeout, check_same_thread=False
+        )
+
+    def fetch(self):
+        self.conn.execute(SQLITE_PROBE_QUERY).fetchall()
+        return {"in_recovery": False, "replay_delay": None, "standby_lag": None}
+
+    def terminate(self):
+        self.conn.close()
+
+
+@dataclass
+class HealthThresholds:
+    latency_ms: float = 100.0
+    pool_saturation: float = 0.9
+    replication_lag_seconds: float = 10.0
+    event_loop_lag_ms: float = 200.0
+
+
+class HealthProber:
+    def __init__(self, database_urls, thresholds=None, interval=2.0, timeout=1.0,
+                 stale_after=None, pool_status=None):
+        self.database_urls = database_urls
+        self.thresholds = thresholds or HealthThresholds()
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_after = stale_after or interval * 3
+        # Callable returning {name: {"size", "idle", "maxSize"}}, or None
+        self.pool_status = pool_status
+        self._connections = {}
+        self._results = {}
+        self._last_success = {}
+        self.event_loop_lag_ms = 0.0
+        self.checked_at = None
+
+    async def _probe(self, name, url):
+        conn = self._connections.get(name)
+        try:
+            if url.startswith("sqlite:"):
+                if conn is None:
+                    conn = await asyncio.to_thread(_SQLiteProbe, url[len("sqlite:///"):], self.timeout)
+                    self._connections[name] = conn
+                started = time.perf_counter()
+                row = await asyncio.wait_for(asyncio.to_thread(conn.fetch), self.timeout)
+            else:
+                if conn is None or conn.is_closed():
+                    conn = await asyncio.wait_for(asyncpg.connect(url), self.timeout)
+                    self._connections[name] = conn
+                started = time.perf_counter()
+                row = await conn.fetchrow(PROBE_QUERY, timeout=self.timeout)
+            latency_ms = (time.perf_counter() - started) * 1000
+        except Exception as e:
+            if conn is not None:
+                conn.terminate()
+            self._connections.pop(name, None)
+            return {"error": f"{type(e).__name__}: {e}"}
+
+        self._last_success[name] = time.monotonic()
+        lag = row["replay_delay"] if row["in_recovery"] else row["standby_lag"]
+        return {
+            "latencyMs": round(latency_ms, 3),
+            "inRecovery": row["in_recovery"],
+            "replicationLagSeconds": float(lag) if lag is not None else None,
+        }
+
+    def _assess(self, name, result, pools):
+        """Add pool figures, the status and the reasons for it to a probe result"""
+        reasons = []
+        status = OK
+        if "error" in result:
+            last = self._last_success.get(name)
+            if last is None or time.monotonic() - last > self.stale_after:
+                status = FAILING
+            else:
+                status = DEGRADED
+            reasons.append(result["error"])
+        else:
+            if result["latencyMs"] > self.thresholds.latency_ms:
+                status = DEGRADED
+                reasons.append(f"latency {result['latencyMs']}ms > {self.thresholds.latency_ms}ms")
+            lag = result["replicationLagSeconds"]
+            if lag is not None and lag > self.thresholds.replication_lag_seconds:
+                status = DEGRADED
+                reasons.append(f"replication lag {lag:.1f}s > {self.thresholds.replication_lag_seconds}s")
+
+        pool = pools.get(name)
+        if pool:
+            in_use = pool["size"] - pool["idle"]
+            saturation = in_use / pool["maxSize"] if pool["maxSize"] else 0.0
+            result["pool"] = {"inUse": in_use, "size": pool["size"], "maxSize": pool["maxSize"],
+                              "saturation": round(saturation, 3)}
+            if saturation >= self.thresholds.pool_saturation:
+                status = max(status, DEGRADED, key=_SEVERITY.get)
+                reasons.append(f"pool saturation {saturation:.0%} >= {self.thresholds.pool_saturation:.0%}")
+
+        result["status"] = status
+        if reasons:
+            result["reasons"] = reasons
+        return result
+
+    async def check(self):
+        """Probe every database once and store the report"""
+        names = list(self.database_urls)
+        results = await asyncio.gather(*(self._probe(name, self.database_urls[name]) for name in names))
+        pools = self.pool_status() if self.pool_status else {}
+        self._results = {name: self._assess(name, result, pools) for name, result in zip(names, results)}
+        self.checked_at = datetime.now(timezone.utc)
+
+    async def run(self):
+        """Probe every `interval` seconds until cancelled (call check() first for an initial report)"""
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                self.event_loop_lag_ms = max(0.0, (time.monotonic() - expected) * 1000)
+                try:
+                    await self.check()
+                except Exception as e:
+                    logger.error(f"Health probe failed: {e}")
+        finally:
+            for conn in self._connections.values():
+                conn.terminate()
+            self._connections = {}
+
+    def report(self):
+        """The latest cached report; never touches the database"""
+        if self.checked_at is None:
+            return {"status": FAILING, "checkedAt": None, "databases": {}, "reasons": ["not probed yet"]}
+
+        status = max((result["status"] for result in self._results.values()), key=_SEVERITY.get, default=OK)
+        report = {
+            "status": status,
+            "checkedAt": self.checked_at.isoformat(),
+            "ageSeconds": round((datetime.now(timezone.utc) - self.checked_at).total_seconds(), 3),
+            "eventLoopLagMs": round(self.event_loop_lag_ms, 3),
+            "databases": self._results,
+        }
+        if report["ageSeconds"] > self.stale_after:
+            report["status"] = FAILING
+            report["reasons"] = ["health report is stale"]
+        elif self.event_loop_lag_ms > self.thresholds.event_loop_lag_ms:
+            report["status"] = max(status, DEGRADED, key=_SEVERITY.get)
+            report["reasons"] = [f"event loop lag {self.event_loop_lag_ms:.0f}ms > {self.thresholds.event_loop_lag_ms}ms"]
+        return report
@@ -1,18 +1,22 @@
 # main.py
 from fastapi import FastAPI, HTTPException, Query, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field, validator
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 import uvicorn
 import os
+import asyncio
 from databases import Database
 import asyncpg
-from sqlalchemy import create_engine, MetaData, Table, Column, String, DateTime, Text, Integer, select
+from sqlalchemy import MetaData, Table, Column, String, DateTime, Text, Integer, select
 from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.sql import and_
 import logging
 from contextlib import asynccontextmanager
+import migrations
+from health import HealthProber, HealthThresholds
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -33,10 +37,29 @@ API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
 API_PORT = int(os.getenv("API_PORT", "8000"))
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 
+# Background health probing (same settings as app.py)
+HEALTH_INTERVAL = float(os.getenv("HEALTH_INTERVAL", "2"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "1"))
+HEALTH_THRESHOLDS = HealthThresholds(
+    latency_ms=float(os.getenv("HEALTH_MAX_DB_LATENCY_MS", "100")),
+    pool_saturation=float(os.getenv("HEALTH_MAX_POOL_SATURATION", "0.9")),
+    replication_lag_seconds=float(os.getenv("HEALTH_MAX_REPLICATION_LAG_SECONDS", "10")),
+    event_loop_lag_ms=float(os.getenv("HEALTH_MAX_EVENT_LOOP_LAG_MS", "200")),
+)
+HEALTH_READY_WHEN_DEGRADED = os.getenv("HEALTH_READY_WHEN_DEGRADED", "true").lower() == "true"
+
 # Database setup
 database = Database(DATABASE_URL)
 metadata = MetaData()
 
+# Probes over its own connection, so health checks never use the shared pool
+health_prober = HealthProber(
+    {"default": DATABASE_URL},
+    thresholds=HEALTH_THRESHOLDS,
+    interval=HEALTH_INTERVAL,
+    timeout=HEALTH_PROBE_TIMEOUT,
+)
+
 # Define tables
 wheel_specifications = Table(
     "wheel_specifications",
@@ -117,14 +140,21 @@ class WheelSpecificationGetResponse(BaseModel):
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting up application...")
+    prober = None
     try:
         await database.connect()
         logger.info("Database connected successfully")
         
-        # Create tables if they don't exist
-        engine = create_engine(DATABASE_URL)
-        metadata.create_all(engine)
+        # Bring the schema up to date without blocking the event loop (shared with app.py)
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await migrations.ensure_schema(conn)
+        finally:
+            await conn.close()
         logger.info("Database tables created/verified")
+
+        await health_prober.check()
+        prober = asyncio.create_task(health_prober.run())
         
         yield
         
@@ -134,6 +164,9 @@ async def lifespan(app: FastAPI):
     finally:
         # Shutdown
         logger.info("Shutting down application...")
+        if prober is not None:
+            prober.cancel()
+            await asyncio.gather(prober, return_exceptions=True)
         await database.disconnect()
         logger.info("Database disconnected")
 
@@ -185,6 +218,12 @@ async def create_wheel_specification(
     try:
         logger.info(f"Attempting to create wheel specification: {wheel_spec.formNumber}")
         
+        # A soft-deleted form no longer holds its number
+        await db.execute(
+            "DELETE FROM wheel_specifications WHERE form_number = :form_number AND deleted_at IS NOT NULL",
+            {"form_number": wheel_spec.formNumber}
+        )
+
         # Check if form number already exists
         existing_query = "SELECT form_number FROM wheel_specifications WHERE form_number = :form_number"
         existing = await db.fetch_one(existing_query, {"form_number": wheel_spec.formNumber})
@@ -255,7 +294,7 @@ async def get_wheel_specifications(
         logger.info(f"Fetching wheel specifications with filters: formNumber={formNumber}, submittedBy={submittedBy}, submittedDate={submittedDate}")
         
         # Build query with filters
-        query = "SELECT * FROM wheel_specifications WHERE 1=1"
+        query = "SELECT * FROM wheel_specifications WHERE deleted_at IS NULL"
         values = {}
         
         if formNumber:
@@ -323,7 +362,7 @@ async def get_wheel_specification_by_id(
     try:
         logger.info(f"Fetching wheel specification: {form_number}")
         
-        query = "SELECT * FROM wheel_specifications WHERE form_number = :form_number"
+        query = "SELECT * FROM wheel_specifications WHERE form_number = :form_number AND deleted_at IS NULL"
         result = await db.fetch_one(query, {"form_number": form_number})
         
         if not result:
@@ -368,9 +407,14 @@ async def delete_wheel_specification(
     try:
         logger.info(f"Attempting to delete wheel specification: {form_number}")
         
-        # Check if form exists
-        check_query = "SELECT form_number FROM wheel_specifications WHERE form_number = :form_number"
-        existing = await db.fetch_one(check_query, {"form_number": form_number})
+        # Soft-delete the live record; the background purge removes it later
+        delete_query = """
+            UPDATE wheel_specifications
+            SET deleted_at = CURRENT_TIMESTAMP
+            WHERE form_number = :form_number AND deleted_at IS NULL
+            RETURNING form_number
+        """
+        existing = await db.fetch_one(delete_query, {"form_number": form_number})
         
         if not existing:
             logger.warning(f"Wheel specification not found for deletion: {form_number}")
@@ -379,10 +423,6 @@ async def delete_wheel_specification(
                 detail=f"Wheel specification with form number {form_number} not found"
             )
         
-        # Delete the record
-        delete_query = "DELETE FROM wheel_specifications WHERE form_number = :form_number"
-        await db.execute(delete_query, {"form_number": form_number})
-        
         logger.info(f"Successfully deleted wheel specification: {form_number}")
         
         return ApiResponse(
@@ -400,29 +440,27 @@ async def delete_wheel_specification(
             detail=f"Internal server error: {str(e)}"
         )
 
-# Health check endpoint
+# Health check endpoints
 @app.get("/health", tags=["Health"])
-async def health_check(db: Database = Depends(get_database)):
+async def health_check():
     """
-    Health check endpoint to verify API and database connectivity
+    Latest background health report (database latency, replication lag, event loop lag).
+    Served from memory; returns 503 while failing.
     """
-    try:
-        # Test database connection
-        await db.fetch_one("SELECT 1")
-        return {
-            "status": "healthy",
-            "database": "connected",
-            "timestamp": datetime.utcnow().isoformat(),
-            "version": "1.0.0"
-        }
-    except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
-        return {
-            "status": "unhealthy",
-            "database": "disconnected",
-            "error": str(e),
-            "timestamp": datetime.utcnow().isoformat()
-        }
+    report = {**health_prober.report(), "version": "1.0.0"}
+    return JSONResponse(status_code=503 if report["status"] == "failing" else 200, content=report)
+
+@app.get("/health/live", tags=["Health"])
+async def liveness_check():
+    """Liveness probe - the process is serving requests"""
+    return {"status": "alive", "pid": os.getpid()}
+
+@app.get("/health/ready", tags=["Health"])
+async def readiness_check():
+    """Readiness probe - 503 while the database is failing (or degraded, if configured)"""
+    status = health_prober.report()["status"]
+    ready = status == "ok" or (status == "degraded" and HEALTH_READY_WHEN_DEGRADED)
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "status": status})
 
 # Error handlers
 @app.exception_handler(404)
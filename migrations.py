@@ -0,0 +1,244 @@
+"""
+Versioned schema migrations for the wheel_specifications database.
+
+Each migration is applied once per database and recorded in
+schema_migrations, so startup only has to compare the recorded version with
+the latest one. Runners hold a Postgres advisory lock while migrating:
+concurrent workers, serve.py and db_setup.py wait for each other instead of
+racing on DDL, then find nothing left to do. Index migrations run outside a
+transaction and use CREATE/DROP INDEX CONCURRENTLY, so they don't block writes.
+
+Statements are idempotent (IF NOT EXISTS), which lets a database created
+before versioning adopt the history without changes. Data backfills run in
+batches outside a transaction, so no table is rewritten under a long lock.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Union
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary application-wide key for pg_advisory_lock
+MIGRATION_LOCK_KEY = 0x6B70615F6D6967
+LOCK_POLL_INTERVAL = 0.2
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    # SQL strings, or async callables taking the connection for steps that loop
+    statements: List[Union[str, Callable[[asyncpg.Connection], Awaitable[None]]]]
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    transactional: bool = True
+
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _search_vector(row=""):
+    """tsvector of a row's form number (A), submitter (B) and measurement values (C)"""
+    return (
+        f"setweight(to_tsvector('simple', regexp_replace(coalesce({row}form_number, ''), '[^[:alnum:]]+', ' ', 'g')), 'A') || "
+        f"setweight(to_tsvector('simple', coalesce({row}submitted_by, '')), 'B') || "
+        f"setweight(jsonb_to_tsvector('simple', {row}fields, '[\"string\"]'), 'C')"
+    )
+
+
+async def _backfill_search_vector(conn):
+    """Fill search_vector for existing rows in id order, one short transaction per batch.
+
+    The trigger already covers rows written meanwhile. A plain column plus this
+    backfill avoids the full-table rewrite under an ACCESS EXCLUSIVE lock that
+    adding a STORED generated column takes.
+    """
+    last_id = 0
+    while True:
+        last_id = await conn.fetchval(f"""
+            WITH batch AS (
+                SELECT id FROM wheel_specifications WHERE id > $1 ORDER BY id LIMIT $2
+            ), filled AS (
+                UPDATE wheel_specifications AS w
+                SET search_vector = {_search_vector("w.")}
+                FROM batch
+                WHERE w.id = batch.id AND w.search_vector IS NULL
+            )
+            SELECT max(id) FROM batch
+        """, last_id, BACKFILL_BATCH_SIZE)
+        if last_id is None:
+            return
+
+
+MIGRATIONS = [
+    Migration(1, "create wheel_specifications", ["""
+        CREATE TABLE IF NOT EXISTS wheel_specifications (
+            id SERIAL PRIMARY KEY,
+            form_number VARCHAR(100) UNIQUE NOT NULL,
+            submitted_by VARCHAR(100) NOT NULL,
+            submitted_date DATE NOT NULL,
+            fields JSONB NOT NULL DEFAULT '{}',
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """]),
+    Migration(2, "lookup indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wheel_specs_form_number ON wheel_specifications (form_number)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wheel_specs_submitted_by ON wheel_specifications (submitted_by)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wheel_specs_submitted_date ON wheel_specifications (submitted_date)",
+    ], transactional=False),
+    Migration(3, "soft delete marker", [
+        "ALTER TABLE wheel_specifications ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE",
+    ]),
+    # The partial index only covers rows awaiting purge
+    Migration(4, "index rows awaiting purge", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wheel_specs_deleted_at ON wheel_specifications (deleted_at) WHERE deleted_at IS NOT NULL",
+    ], transactional=False),
+    # BRIN index for range scans on the append-mostly created_at
+    # (submitted_date already has the btree from migration 2)
+    Migration(5, "BRIN index on created_at", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wheel_specs_created_at_brin ON wheel_specifications USING brin (created_at)",
+    ], transactional=False),
+    # Full-text search over the form number, submitter and measurement values
+    Migration(6, "search vector", [
+        "ALTER TABLE wheel_specifications ADD COLUMN IF NOT EXISTS search_vector tsvector",
+        f"""
+        CREATE OR REPLACE FUNCTION wheel_specs_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {_search_vector("NEW.")};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        DROP TRIGGER IF EXISTS wheel_specs_search_vector ON wheel_specifications;
+        CREATE TRIGGER wheel_specs_search_vector
+        BEFORE INSERT OR UPDATE OF form_number, submitted_by, fields ON wheel_specifications
+        FOR EACH ROW EXECUTE FUNCTION wheel_specs_search_vector()
+        """,
+        _backfill_search_vector,
+    ], transactional=False),
+    Migration(7, "search index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wheel_specs_search ON wheel_specifications USING gin (search_vector)",
+    ], transactional=False),
+    # main.py records a workflow status on every form
+    Migration(8, "form status", [
+        "ALTER TABLE wheel_specifications ADD COLUMN IF NOT EXISTS status VARCHAR(50) DEFAULT 'Saved'",
+    ]),
+    # Bulk-delete and purge jobs, shared by every worker so any of them can
+    # report on a job or resume it. Only the first shard's table is used
+    Migration(9, "background jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id VARCHAR(32) PRIMARY KEY,
+            kind VARCHAR(50) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'running',
+            processed BIGINT NOT NULL DEFAULT 0,
+            criteria JSONB NOT NULL DEFAULT '{}',
+            error TEXT,
+            owner VARCHAR(32),
+            started_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            heartbeat_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP WITH TIME ZONE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs (started_at) WHERE status = 'running'",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+_CONCURRENT_INDEX = re.compile(r"CREATE INDEX CONCURRENTLY IF NOT EXISTS (\w+)", re.IGNORECASE)
+
+
+async def current_version(conn) -> int:
+    """Highest applied migration, or 0 for an unversioned database"""
+    try:
+        return await conn.fetchval("SELECT coalesce(max(version), 0) FROM schema_migrations")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def _drop_invalid_index(conn, statement):
+    """Drop an index left INVALID by an interrupted CONCURRENTLY build, so it is rebuilt"""
+    match = _CONCURRENT_INDEX.search(statement)
+    if not match:
+        return
+    invalid = await conn.fetchval("""
+        SELECT 1 FROM pg_index
+        WHERE indexrelid = to_regclass($1) AND NOT indisvalid
+    """, match.group(1))
+    if invalid:
+        logger.warning(f"Rebuilding invalid index {match.group(1)}")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+async def _lock(conn):
+    """Take the migration lock by polling.
+
+    A session blocked inside pg_advisory_lock() holds a snapshot, which a
+    concurrent CREATE INDEX CONCURRENTLY waits for, so blocking would deadlock.
+    """
+    while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_KEY):
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+
+async def migrate(conn, target: int = LATEST_VERSION) -> List[int]:
+    """Apply every pending migration up to `target`; returns the versions applied.
+
+    `conn` must not be inside a transaction.
+    """
+    await _lock(conn)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                duration_ms REAL NOT NULL
+            )
+        """)
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+
+        done = []
+        for migration in MIGRATIONS:
+            if migration.version in applied or migration.version > target:
+                continue
+            started = time.perf_counter()
+            if migration.transactional:
+                async with conn.transaction():
+                    for statement in migration.statements:
+                        await (statement(conn) if callable(statement) else conn.execute(statement))
+                    await _record(conn, migration, started)
+            else:
+                for statement in migration.statements:
+                    if callable(statement):
+                        await statement(conn)
+                        continue
+                    await _drop_invalid_index(conn, statement)
+                    await conn.execute(statement)
+                await _record(conn, migration, started)
+            logger.info(f"Applied migration {migration.version}: {migration.description}")
+            done.append(migration.version)
+        return done
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+
+
+async def _record(conn, migration, started):
+    await conn.execute(
+        "INSERT INTO schema_migrations (version, description, duration_ms) VALUES ($1, $2, $3)",
+        migration.version, migration.description, (time.perf_counter() - started) * 1000
+    )
+
+
+async def ensure_schema(conn) -> List[int]:
+    """Cheap startup check: migrate only when the recorded version is behind"""
+    if await current_version(conn) >= LATEST_VERSION:
+        return []
+    return await migrate(conn)
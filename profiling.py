@@ -0,0 +1,278 @@
+"""
+On-demand profiling of single requests.
+
+A request carrying `X-Profile: cprofile|pyinstrument|1` (or `?profile=...`)
+plus a valid `X-Admin-Token` is run under a profiler:
+
+* cprofile: deterministic, every function call. cProfile sees the whole
+  thread, so work of other requests served concurrently is included.
+* pyinstrument: statistical, attributes time only to the profiled request's
+  async context and shows awaits as waits. Used for `1` when installed.
+
+Alongside the profile, the request's wall-clock time is split into CPU time,
+database wait (pool acquire and queries), admission wait and the rest, spent
+waiting on the event loop. CPU time is the thread's, so it includes other
+requests' work interleaved with this one and, for cprofile, the profiler's
+own overhead. The split is built from the request's tracing
+spans, which are collected for profiled requests whether tracing is enabled
+or not. Only one request is profiled at a time; others are served normally.
+Profiles and their JSON summaries are written to a directory and pruned to
+the newest `keep`.
+"""
+
+import asyncio
+import cProfile
+import hmac
+import json
+import marshal
+import os
+import pstats
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+import tracing
+
+try:
+    import pyinstrument
+except ImportError:  # pragma: no cover - optional dependency
+    pyinstrument = None
+
+PROFILERS = ("cprofile", "pyinstrument")
+TOP_FUNCTIONS = 25
+
+
+def _union_ms(intervals):
+    """Total length of possibly overlapping (start, end) ns intervals, in ms"""
+    total, reach = 0, None
+    for start, end in sorted(intervals):
+        if reach is None or start > reach:
+            total += end - start
+            reach = end
+        elif end > reach:
+            total += end - reach
+            reach = end
+    return total / 1e6
+
+
+def time_split(spans, wall_ms, cpu_ms):
+    """Wall-clock split of a request into CPU, database wait, admission wait and the rest.
+
+    Database wait is the time spans spent in pool acquire and queries minus
+    the CPU used meanwhile (asyncpg's protocol work), so the parts add up to
+    the wall-clock time.
+    """
+    def spans_named(*names):
+        return [s for s in spans if s.name in names]
+
+    db_spans = spans_named("db.acquire", "db.query")
+    db_cpu_ms = sum(s.cpu_ns for s in db_spans) / 1e6
+    db_ms = max(0.0, _union_ms([(s.start_ns, s.end_ns) for s in db_spans]) - db_cpu_ms)
+    admission_ms = _union_ms([(s.start_ns, s.end_ns) for s in spans_named("admission")])
+    return {
+        "wallMs": round(wall_ms, 3),
+        "cpuMs": round(cpu_ms, 3),
+        "dbWaitMs": round(db_ms, 3),
+        "admissionWaitMs": round(admission_ms, 3),
+        "eventLoopMs": round(max(0.0, wall_ms - cpu_ms - db_ms - admission_ms), 3),
+    }
+
+
+class RequestProfiler:
+    def __init__(self, admin_token, directory="profiles", keep=100, default="pyinstrument"):
+        self.admin_token = admin_token
+        self.directory = directory
+        self.keep = keep
+        self.default = default if default != "pyinstrument" or pyinstrument is not None else "cprofile"
+        self.busy = False
+
+    @property
+    def enabled(self):
+        return bool(self.admin_token)
+
+    def authorized(self, token):
+        return self.enabled and token is not None and hmac.compare_digest(token, self.admin_token)
+
+    def resolve(self, requested):
+        """Profiler name for an X-Profile value, or None if it isn't available"""
+        requested = requested.strip().lower()
+        if requested in ("1", "true", "yes"):
+            return self.default
+        if requested == "pyinstrument" and pyinstrument is None:
+            return None
+        return requested if requested in PROFILERS else None
+
+    def _save(self, profile_id, summary, extension, data):
+        os.makedirs(self.directory, exist_ok=True)
+        summary["file"] = f"{profile_id}.{extension}"
+        mode = "w" if isinstance(data, str) else "wb"
+        with open(os.path.join(self.directory, summary["file"]), mode) as f:
+            f.write(data)
+        with open(os.path.join(self.directory, f"{profile_id}.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        self._prune()
+
+    def _prune(self):
+        summaries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime, reverse=True
+        )
+        for entry in summaries[self.keep:]:
+            profile_id = entry.name[:-len(".json")]
+            for name in os.listdir(self.directory):
+                if name.startswith(profile_id + "."):
+                    os.remove(os.path.join(self.directory, name))
+
+    def list(self, limit=50):
+        """Summaries of saved profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime, reverse=True
+        )[:limit]
+        summaries = []
+        for entry in entries:
+            with open(entry.path) as f:
+                summaries.append(json.load(f))
+        return summaries
+
+    def path_of(self, profile_id):
+        """Path of a saved profile's data file, or None"""
+        summary_path = os.path.join(self.directory, f"{os.path.basename(profile_id)}.json")
+        if not os.path.isfile(summary_path):
+            return None
+        with open(summary_path) as f:
+            return os.path.join(self.directory, json.load(f)["file"])
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        requested = headers.get(b"x-profile", b"").decode("latin-1")
+        if not requested:
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            requested = query.get("profile", [""])[0]
+        if not requested:
+            await self.app(scope, receive, send)
+            return
+
+        token = headers.get(b"x-admin-token")
+        if not self.profiler.authorized(token.decode("latin-1") if token else None):
+            await _send_json(send, 403, {"detail": "Profiling requires a valid X-Admin-Token"})
+            return
+        name = self.profiler.resolve(requested)
+        if name is None:
+            await _send_json(send, 400, {"detail": f"Unknown or unavailable profiler '{requested}'"})
+            return
+        if self.profiler.busy:
+            await self.app(scope, receive, _with_header(send, b"x-profile", b"busy"))
+            return
+
+        self.profiler.busy = True
+        try:
+            await self._profile(name, scope, receive, send)
+        finally:
+            self.profiler.busy = False
+
+    async def _profile(self, name, scope, receive, send):
+        profile_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        status = None
+
+        async def send_profiled(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if root.serializing:
+                    root.end_phase("response.serialize")
+                message = {**message, "headers": [
+                    *message.get("headers", []), (b"x-profile-id", profile_id.encode("latin-1"))
+                ]}
+            await send(message)
+
+        if name == "pyinstrument":
+            profiler = pyinstrument.Profiler(async_mode="enabled")
+        else:
+            profiler = cProfile.Profile()
+
+        started_at = datetime.now(timezone.utc)
+        wall_started, cpu_started = time.perf_counter(), time.thread_time()
+        with tracing.collect("profile") as spans:
+            root = tracing.current_span()
+            if name == "pyinstrument":
+                profiler.start()
+            else:
+                profiler.enable()
+            try:
+                await self.app(scope, receive, send_profiled)
+            finally:
+                if name == "pyinstrument":
+                    profiler.stop()
+                else:
+                    profiler.disable()
+        wall_ms = (time.perf_counter() - wall_started) * 1000
+        cpu_ms = (time.thread_time() - cpu_started) * 1000
+
+        summary = {
+            "id": profile_id,
+            "profiler": name,
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "status": status,
+            "startedAt": started_at.isoformat(),
+            **time_split(spans, wall_ms, cpu_ms),
+            "spans": [
+                {"name": s.name, "ms": round((s.end_ns - s.start_ns) / 1e6, 3), **s.attributes}
+                for s in sorted(spans, key=lambda s: s.start_ns) if s.name != "db.statement"
+            ],
+        }
+        if name == "pyinstrument":
+            extension, data = "html", profiler.output_html()
+        else:
+            extension = "prof"
+            stats = pstats.Stats(profiler)
+            # The format Stats.dump_stats writes, loadable by pstats / snakeviz
+            data = marshal.dumps(stats.stats)
+            summary["topFunctions"] = _top_functions(stats)
+        await asyncio.to_thread(self.profiler._save, profile_id, summary, extension, data)
+
+
+def _top_functions(stats):
+    stats.sort_stats("cumulative")
+    top = []
+    for func in stats.fcn_list[:TOP_FUNCTIONS]:
+        calls, primitive_calls, total_time, cumulative_time, _ = stats.stats[func]
+        filename, line, function = func
+        top.append({
+            "function": f"{function} ({os.path.basename(filename)}:{line})",
+            "calls": calls,
+            "totalMs": round(total_time * 1000, 3),
+            "cumulativeMs": round(cumulative_time * 1000, 3),
+        })
+    return top
+
+
+def _with_header(send, name, value):
+    async def send_with_header(message):
+        if message["type"] == "http.response.start":
+            message = {**message, "headers": [*message.get("headers", []), (name, value)]}
+        await send(message)
+    return send_with_header
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())
+    ]})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the Wheel Specifications API.
+
+Runs the app under uvicorn's process supervisor:
+
+* one worker per CPU this process may run on (WEB_CONCURRENCY overrides),
+* each worker's asyncpg pool sized so that all workers together stay under
+  every shard server's max_connections, minus a reserve for admin sessions,
+  with room for the extra worker that overlaps during a SIGHUP restart,
+* uvloop / httptools when they are installed,
+* graceful drain on SIGTERM: workers stop accepting, finish in-flight
+  requests for up to GRACEFUL_TIMEOUT seconds, then close their pools,
+* rolling recycling: each worker exits after MAX_REQUESTS (+ jitter) requests
+  and is replaced; SIGHUP replaces all workers one at a time.
+
+Schema migrations are applied once here, before any worker starts. Each worker
+reports ready on /health/ready once its pools are warm. With embedded SQLite
+storage there are no pools to size; workers share the database file and take
+turns writing.
+
+Usage:
+    python serve.py --host 0.0.0.0 --port 8000
+    uvicorn app:app --reload          # development
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+from urllib.parse import urlsplit
+
+import asyncpg
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+import migrations
+import sqlite_storage
+from storage import create_database_if_missing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("serve")
+
+
+def available_cpus():
+    """CPUs this process may run on (respects taskset / cgroup cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS / Windows
+        return os.cpu_count() or 1
+
+
+def pick_loop(choice):
+    if choice != "auto":
+        return choice
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def pick_http(choice):
+    if choice != "auto":
+        return choice
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+async def prepare_database(shard_urls):
+    """Create every shard's schema and return {server: connections available to the app}.
+
+    Shards living on the same Postgres server share its connection budget.
+    """
+    budgets = {}
+    for url in shard_urls.values():
+        await create_database_if_missing(url)
+        conn = await asyncpg.connect(url)
+        try:
+            await migrations.migrate(conn)
+            max_connections = int(await conn.fetchval("SHOW max_connections"))
+            reserved = int(await conn.fetchval("SHOW superuser_reserved_connections"))
+        finally:
+            await conn.close()
+        parts = urlsplit(url)
+        budgets[(parts.hostname, parts.port or 5432)] = max_connections - reserved
+    return budgets
+
+
+def prepare_sqlite(path):
+    """Create the embedded database file and bring its schema up to date"""
+    conn = sqlite_storage.connect(path)
+    try:
+        sqlite_storage.migrate(conn)
+    finally:
+        conn.close()
+
+
+def size_pools(shard_urls, budgets, workers, reserve):
+    """Largest per-worker pool size that keeps every server under its budget.
+
+    Besides its pool, each worker holds one HealthProber connection per shard.
+    A SIGHUP restart starts each replacement before retiring the worker it
+    replaces, so room is kept for one worker more than `workers`.
+    """
+    shards_per_server = {}
+    for url in shard_urls.values():
+        parts = urlsplit(url)
+        server = (parts.hostname, parts.port or 5432)
+        shards_per_server[server] = shards_per_server.get(server, 0) + 1
+
+    return min(
+        (budgets[server] - reserve) // ((workers + 1) * shards) - 1
+        for server, shards in shards_per_server.items()
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with multiple uvicorn workers")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")),
+                        help="Worker processes (default: available CPUs)")
+    parser.add_argument("--reserve", type=int, default=int(os.getenv("DB_CONNECTION_RESERVE", "10")),
+                        help="Connections per server left free for admin sessions and migrations")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="Seconds a stopping worker waits for in-flight requests")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("MAX_REQUESTS", "10000")),
+                        help="Requests before a worker is recycled (0 disables)")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.getenv("MAX_REQUESTS_JITTER", "1000")),
+                        help="Random extra requests so workers don't recycle together")
+    parser.add_argument("--loop", default=os.getenv("UVICORN_LOOP", "auto"), choices=["auto", "uvloop", "asyncio"])
+    parser.add_argument("--http", default=os.getenv("UVICORN_HTTP", "auto"), choices=["auto", "httptools", "h11"])
+    args = parser.parse_args()
+
+    from app import DATABASE_URL, DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE, SHARD_URLS
+
+    workers = args.workers or available_cpus()
+    if sqlite_storage.is_sqlite_url(DATABASE_URL):
+        prepare_sqlite(sqlite_storage.sqlite_path(DATABASE_URL))
+        pool = "embedded SQLite"
+    else:
+        budgets = asyncio.run(prepare_database(SHARD_URLS))
+        budget = size_pools(SHARD_URLS, budgets, workers, args.reserve)
+        if budget < 1:
+            raise SystemExit(
+                f"max_connections leaves no room for {workers} workers plus one restarting; "
+                f"lower --workers or --reserve, or raise max_connections"
+            )
+
+        # Workers are spawned processes and read their pool size from the environment
+        pool_max = min(DB_POOL_MAX_SIZE, budget)
+        os.environ["DB_POOL_MAX_SIZE"] = str(pool_max)
+        os.environ["DB_POOL_MIN_SIZE"] = str(min(DB_POOL_MIN_SIZE, pool_max))
+        pool = f"pool {os.environ['DB_POOL_MIN_SIZE']}-{pool_max} per worker and shard"
+
+    loop, http = pick_loop(args.loop), pick_http(args.http)
+    logger.info(
+        f"Starting {workers} workers on {args.host}:{args.port} "
+        f"({pool}, loop={loop}, http={http})"
+    )
+
+    config = uvicorn.Config(
+        "app:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_max_requests=args.max_requests or None,
+        limit_max_requests_jitter=args.max_requests_jitter if args.max_requests else 0,
+        proxy_headers=True,
+    )
+    # Run under the supervisor even with one worker, so recycled workers are replaced
+    Multiprocess(config, sockets=[config.bind_socket()]).run()
+
+
+if __name__ == "__main__":
+    main()
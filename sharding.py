@@ -0,0 +1,187 @@
+"""
+Hash sharding of wheel_specifications across several PostgreSQL databases.
+
+Forms are placed on a consistent-hash ring by form_number, so lookups and
+writes route to exactly one shard, while list, search and count queries
+scatter to every shard and merge the results. When shards are added, only
+the ring ranges the new shard takes over change owner; rebalance() moves
+exactly those rows.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import heapq
+import logging
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD = "default"
+
+
+def parse_shard_urls(value, default_url):
+    """Parse SHARD_DATABASE_URLS into an ordered {name: dsn} mapping.
+
+    Entries are comma-separated and may be named (`shard0=postgresql://...`);
+    unnamed entries are called shard0, shard1, ... by position. Without any
+    entries the single DATABASE_URL is the only shard.
+    """
+    shards = {}
+    for index, entry in enumerate(part.strip() for part in (value or "").split(",")):
+        if not entry:
+            continue
+        name, separator, url = entry.partition("=")
+        if not separator or "://" in name:
+            name, url = f"shard{index}", entry
+        shards[name.strip()] = url.strip()
+    return shards or {DEFAULT_SHARD: default_url}
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent-hash ring over named shards, with virtual nodes for balance"""
+
+    def __init__(self, names, vnodes=64):
+        self.names = list(names)
+        points = sorted(
+            (_hash(f"{name}#{replica}"), name)
+            for name in self.names
+            for replica in range(vnodes)
+        )
+        self._positions = [position for position, _ in points]
+        self._owners = [name for _, name in points]
+
+    def shard_for(self, key):
+        """Name of the shard owning `key`"""
+        if len(self.names) == 1:
+            return self.names[0]
+        index = bisect.bisect(self._positions, _hash(key)) % len(self._positions)
+        return self._owners[index]
+
+
+def merge_sorted(result_lists, sort_key, limit, offset=0):
+    """Merge per-shard results, each already sorted descending by `sort_key`, into one page"""
+    merged = heapq.merge(*result_lists, key=sort_key, reverse=True)
+    page = []
+    for index, row in enumerate(merged):
+        if index >= offset + limit:
+            break
+        if index >= offset:
+            page.append(row)
+    return page
+
+
+MOVE_COLUMNS = (
+    "form_number", "submitted_by", "submitted_date", "fields",
+    "created_at", "updated_at", "deleted_at",
+)
+MOVE_TYPES = ("varchar", "varchar", "date", "jsonb", "timestamptz", "timestamptz", "timestamptz")
+
+
+async def rebalance(shard_urls, vnodes=64, batch_size=500, dry_run=False, drained=False,
+                    api_application_name=None):
+    """Move every row that the ring assigns to a different shard than the one holding it.
+
+    Rows are scanned in id order in batches. Each batch is written to its new
+    shard and then deleted from the old one, so an interrupted run can simply
+    be restarted. When the target already has a form with the same number,
+    the newer row by updated_at is kept: an older target row is overwritten,
+    and a source row that is not newer is dropped as superseded. Only source
+    rows whose data the target now holds are deleted. Row ids are per shard
+    and are reassigned on the target.
+
+    Returns ({(source, target): rows moved}, {(source, target): rows superseded}).
+
+    The API routes by the new ring as soon as it runs with the new shards, so
+    rows would 404 until moved and writes to them could be lost: moving is a
+    maintenance-window job. Unless `dry_run`, the caller must confirm with
+    `drained` that no API worker is running, and any shard still holding
+    connections named `api_application_name` makes it refuse.
+    """
+    if not dry_run and not drained:
+        raise RuntimeError("Rebalancing needs a maintenance window: stop the API, then confirm it is drained")
+    ring = HashRing(shard_urls, vnodes=vnodes)
+    connections = {name: await asyncpg.connect(url) for name, url in shard_urls.items()}
+    moved = {}
+    superseded = {}
+    columns = ", ".join(MOVE_COLUMNS)
+    arrays = ", ".join(f"${index}::{column_type}[]" for index, column_type in enumerate(MOVE_TYPES, 1))
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in MOVE_COLUMNS[1:])
+    try:
+        if not dry_run and api_application_name:
+            busy = [
+                name for name, conn in connections.items()
+                if await conn.fetchval(
+                    "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND application_name = $1",
+                    api_application_name
+                )
+            ]
+            if busy:
+                raise RuntimeError(f"API connections are still open on {', '.join(busy)}; stop every API worker first")
+        for source, conn in connections.items():
+            last_id = 0
+            while True:
+                rows = await conn.fetch(
+                    f"SELECT id, {columns} FROM wheel_specifications WHERE id > $1 ORDER BY id LIMIT $2",
+                    last_id, batch_size
+                )
+                if not rows:
+                    break
+                last_id = rows[-1]["id"]
+
+                outgoing = {}
+                for row in rows:
+                    target = ring.shard_for(row["form_number"])
+                    if target != source:
+                        outgoing.setdefault(target, []).append(row)
+
+                for target, batch in outgoing.items():
+                    target_conn = connections[target]
+                    async with target_conn.transaction():
+                        existing = dict(await target_conn.fetch(
+                            f"""
+                            SELECT form_number, updated_at FROM wheel_specifications
+                            WHERE form_number = ANY($1::varchar[])
+                            {"" if dry_run else "FOR UPDATE"}
+                            """,
+                            [row["form_number"] for row in batch]
+                        ))
+                        stale = {
+                            row["form_number"] for row in batch
+                            if row["form_number"] in existing and row["updated_at"] <= existing[row["form_number"]]
+                        }
+                        if dry_run:
+                            copied = {row["form_number"] for row in batch} - stale
+                        else:
+                            copied = {record["form_number"] for record in await target_conn.fetch(
+                                f"""
+                                INSERT INTO wheel_specifications ({columns})
+                                SELECT * FROM unnest({arrays})
+                                ON CONFLICT (form_number) DO UPDATE SET {updates}
+                                WHERE EXCLUDED.updated_at > wheel_specifications.updated_at
+                                RETURNING form_number
+                                """,
+                                *([row[column] for row in batch] for column in MOVE_COLUMNS)
+                            )}
+                    moved[(source, target)] = moved.get((source, target), 0) + len(copied)
+                    if stale:
+                        superseded[(source, target)] = superseded.get((source, target), 0) + len(stale)
+                        logger.warning(
+                            f"{target} already holds a newer copy of {len(stale)} forms from {source}: "
+                            f"{', '.join(sorted(stale))}"
+                        )
+                    if dry_run:
+                        continue
+                    await conn.execute(
+                        "DELETE FROM wheel_specifications WHERE id = ANY($1::int[])",
+                        [row["id"] for row in batch if row["form_number"] in copied | stale]
+                    )
+                    logger.info(f"Moved {len(copied)} rows from {source} to {target}")
+    finally:
+        await asyncio.gather(*(conn.close() for conn in connections.values()))
+    return moved, superseded
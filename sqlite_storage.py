@@ -0,0 +1,950 @@
+"""
+Embedded SQLite storage for single-box (depot) deployments.
+
+Selected by a sqlite:// DATABASE_URL: sqlite:///forms.db for a path relative
+to the working directory, sqlite:////var/lib/kpa/forms.db for an absolute
+one. It serves the same routes as Postgres without a database server:
+
+* WAL journal, so readers never block the writer or each other.
+* A dedicated writer thread owns the only writing connection and runs each
+  write operation as one BEGIN IMMEDIATE transaction, in arrival order, so
+  writes from this process never contend for the database lock.
+* A few reader threads, each with its own read-only connection, run reads
+  off the event loop.
+* Full-text search uses an FTS5 table kept current by triggers, which pull
+  the measurement values out of the JSON `fields` with JSON1's json_each.
+  Projections and PATCH merges use JSON1 as well.
+
+Timestamps are stored as microseconds since the epoch (UTC), assigned by the
+writer thread; dates as ISO text. Every write also takes the next value of a
+database-wide change counter, which sync follows. The database is not
+ANALYZEd: statistics gathered while a depot's table is small mislead the
+planner once it grows, and the queries here are shaped for the default one. A progress handler
+interrupts a statement once its connection's deadline passes, and requests
+whose client disconnects interrupt their running statement.
+
+sync_to_postgres() pushes a depot's changes to a central Postgres deployment
+with COPY. Requires SQLite 3.38 or newer, with FTS5.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+import asyncpg
+
+import migrations
+from sharding import HashRing
+from storage import COLUMNS, JOB_COLUMNS, LOCK_POLL_INTERVAL, StatementTimeout, VersionConflict
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+TIMESTAMP_COLUMNS = {
+    "created_at", "updated_at", "deleted_at", "sort_created_at", "started_at", "heartbeat_at", "finished_at"
+}
+
+# SQLite virtual machine steps between deadline checks
+PROGRESS_STEPS = 1000
+
+# bm25 column weights (form number, submitter, measurements), as in the
+# Postgres search vector's A/B/C weights
+SEARCH_RANK = "bm25(wheel_specifications_search, 5.0, 2.0, 1.0)"
+
+MIGRATIONS = [
+    migrations.Migration(1, "create wheel_specifications", [
+        """
+        CREATE TABLE wheel_specifications (
+            -- AUTOINCREMENT: a purged id is never handed out again, like the
+            -- Postgres serial, so ids (and search rowids) stay unique forever
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            form_number TEXT UNIQUE NOT NULL,
+            submitted_by TEXT NOT NULL,
+            submitted_date TEXT NOT NULL,
+            fields TEXT NOT NULL DEFAULT '{}' CHECK (json_valid(fields)),
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            deleted_at INTEGER,
+            change_seq INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_wheel_specs_submitted_by ON wheel_specifications (submitted_by)",
+        "CREATE INDEX idx_wheel_specs_submitted_date ON wheel_specifications (submitted_date)",
+        # Newest-first listing and created_at ranges only ever read live rows
+        "CREATE INDEX idx_wheel_specs_live_created_at ON wheel_specifications (created_at) WHERE deleted_at IS NULL",
+        "CREATE INDEX idx_wheel_specs_deleted_at ON wheel_specifications (deleted_at) WHERE deleted_at IS NOT NULL",
+        "CREATE INDEX idx_wheel_specs_change_seq ON wheel_specifications (change_seq)",
+        """
+        CREATE VIRTUAL TABLE wheel_specifications_search
+        USING fts5(number, submitter, measurements, tokenize = 'unicode61')
+        """,
+        """
+        CREATE TRIGGER wheel_specs_search_insert AFTER INSERT ON wheel_specifications BEGIN
+            INSERT INTO wheel_specifications_search (rowid, number, submitter, measurements)
+            VALUES (new.id, new.form_number, new.submitted_by,
+                    (SELECT group_concat(value, ' ') FROM json_each(new.fields) WHERE type = 'text'));
+        END
+        """,
+        """
+        CREATE TRIGGER wheel_specs_search_update AFTER UPDATE OF form_number, submitted_by, fields
+        ON wheel_specifications BEGIN
+            UPDATE wheel_specifications_search
+            SET number = new.form_number,
+                submitter = new.submitted_by,
+                measurements = (SELECT group_concat(value, ' ') FROM json_each(new.fields) WHERE type = 'text')
+            WHERE rowid = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER wheel_specs_search_delete AFTER DELETE ON wheel_specifications BEGIN
+            DELETE FROM wheel_specifications_search WHERE rowid = old.id;
+        END
+        """,
+        # Database-wide change counter. Every write transaction takes the next
+        # value while it holds the write lock, so values follow commit order
+        # across processes and sync_to_postgres() can resume from the last one
+        "CREATE TABLE sync_seq (id INTEGER PRIMARY KEY CHECK (id = 1), value INTEGER NOT NULL)",
+        "INSERT INTO sync_seq (id, value) VALUES (1, 0)",
+        # Form numbers that left the table (purged, or renamed away) since the
+        # last sync, so the central copies are deleted too
+        """
+        CREATE TABLE sync_tombstones (
+            form_number TEXT PRIMARY KEY,
+            updated_at INTEGER NOT NULL,
+            deleted_at INTEGER NOT NULL,
+            change_seq INTEGER NOT NULL
+        )
+        """,
+        # Newest change pushed to each central deployment by sync_to_postgres()
+        "CREATE TABLE sync_state (target TEXT PRIMARY KEY, synced_seq INTEGER NOT NULL)",
+        # Bulk-delete and purge jobs, shared by every worker process
+        """
+        CREATE TABLE jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            processed INTEGER NOT NULL DEFAULT 0,
+            criteria TEXT NOT NULL DEFAULT '{}',
+            error TEXT,
+            owner TEXT,
+            started_at INTEGER NOT NULL,
+            heartbeat_at INTEGER NOT NULL,
+            finished_at INTEGER
+        )
+        """,
+        "CREATE INDEX idx_jobs_running ON jobs (started_at) WHERE status = 'running'",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+# Arrow type of an export column -> SQLite cast of the extracted value
+_EXPORT_CASTS = {"int64": "INTEGER", "float64": "REAL", "bool": "INTEGER"}
+
+
+def is_sqlite_url(url):
+    return url.startswith("sqlite:")
+
+
+def sqlite_path(url):
+    """File path of a sqlite:///relative/path or sqlite:////absolute/path URL"""
+    if not url.startswith("sqlite:///"):
+        raise ValueError(f"Expected a sqlite:///path URL, got {url!r}")
+    return url[len("sqlite:///"):]
+
+
+def to_micros(value: datetime) -> int:
+    """Microseconds since the epoch; naive datetimes are taken as UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _record(cursor, row):
+    """Row factory: a dict with timestamps and dates converted back to datetime / date"""
+    record = {}
+    for (name, *_), value in zip(cursor.description, row):
+        if value is not None:
+            if name in TIMESTAMP_COLUMNS:
+                value = from_micros(value)
+            elif name == "submitted_date":
+                value = date.fromisoformat(value)
+        record[name] = value
+    return record
+
+
+def _one(cursor):
+    """First row of a statement, run to completion"""
+    rows = cursor.fetchall()
+    return rows[0] if rows else None
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _next_change(db):
+    """Next value of the change counter; call inside the write transaction"""
+    return _one(db.execute("UPDATE sync_seq SET value = value + 1 RETURNING value"))["value"]
+
+
+def connect(path, read_only=False, synchronous="NORMAL", cache_mb=64, busy_timeout=5.0):
+    """Connection in autocommit mode (transactions are explicit) with WAL and the tuning pragmas"""
+    conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+    conn.row_factory = _record
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    conn.execute(f"PRAGMA cache_size = -{int(cache_mb * 1024)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def current_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()["user_version"]
+
+
+def migrate(conn):
+    """Apply every pending migration, each in one transaction; returns the versions applied"""
+    done = []
+    for migration in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Checked under the write lock, so concurrent processes apply each migration once
+            if current_version(conn) >= migration.version:
+                conn.execute("COMMIT")
+                continue
+            started = time.perf_counter()
+            for statement in migration.statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {migration.version}")
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        logger.info(
+            f"Applied SQLite migration {migration.version}: {migration.description} "
+            f"({(time.perf_counter() - started) * 1000:.0f}ms)"
+        )
+        done.append(migration.version)
+    return done
+
+
+def _select_list(projection):
+    if projection is None:
+        return ", ".join(COLUMNS)
+    columns = list(projection.columns)
+    # Keys were checked against the fields model by the caller, so they are safe to inline
+    if projection.field_keys and "fields" not in columns:
+        pairs = ", ".join(f"'{key}', fields -> '$.\"{key}\"'" for key in projection.field_keys)
+        columns.append(f"json_object({pairs}) AS fields")
+    return ", ".join(columns)
+
+
+def _source(form_filter):
+    """FROM clause: searches join the FTS table so matches can be ranked.
+
+    CROSS JOIN pins the FTS match as the outer loop, with one primary key
+    lookup per match; otherwise an index on a filtered column can win and
+    run the whole FTS query once per row.
+    """
+    if form_filter.search:
+        return """wheel_specifications_search
+            CROSS JOIN wheel_specifications ON wheel_specifications.id = wheel_specifications_search.rowid"""
+    return "wheel_specifications"
+
+
+def _where(form_filter):
+    conditions = ["deleted_at IS NULL"]
+    params = []
+    filters = [
+        ("form_number LIKE ?", f"%{form_filter.form_number_contains}%" if form_filter.form_number_contains else None),
+        ("submitted_by LIKE ?", f"%{form_filter.submitted_by_contains}%" if form_filter.submitted_by_contains else None),
+        ("submitted_by = ?", form_filter.submitted_by),
+        ("submitted_date = ?", _iso(form_filter.submitted_date)),
+        ("submitted_date >= ?", _iso(form_filter.submitted_from)),
+        ("submitted_date <= ?", _iso(form_filter.submitted_to)),
+        ("created_at >= ?", to_micros(form_filter.created_from) if form_filter.created_from else None),
+        ("created_at <= ?", to_micros(form_filter.created_to) if form_filter.created_to else None),
+    ]
+    for condition, value in filters:
+        if value is not None:
+            params.append(value)
+            conditions.append(condition)
+    if form_filter.search:
+        params.append(" ".join(f'"{term}"*' for term in form_filter.search))
+        conditions.append("wheel_specifications_search MATCH ?")
+    return "WHERE " + " AND ".join(conditions), params
+
+
+def _bury(db, forms, change):
+    """Record (form_number, updated_at, deleted_at) tombstones of forms that left the table"""
+    db.executemany("""
+        INSERT INTO sync_tombstones (form_number, updated_at, deleted_at, change_seq)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (form_number) DO UPDATE SET
+            updated_at = excluded.updated_at,
+            deleted_at = excluded.deleted_at,
+            change_seq = excluded.change_seq
+    """, [(*form, change) for form in forms])
+
+
+def _with_deadline(conn, deadline, fn, *args):
+    """Run fn(*args), interrupting it once `deadline` (time.monotonic()) passes"""
+    if deadline is None:
+        return fn(*args)
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+    try:
+        return fn(*args)
+    except sqlite3.OperationalError as e:
+        if str(e) == "interrupted" and time.monotonic() > deadline:
+            raise StatementTimeout("SQLite statement exceeded the deadline") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+class _Session:
+    """What SQLiteStorage.connection() yields: the deadline its operations share"""
+
+    __slots__ = ("deadline_ms", "deadline")
+
+    def __init__(self, deadline_ms):
+        self.deadline_ms = deadline_ms
+        self.deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms else None
+
+
+class SQLiteStorage:
+    """One SQLite database file behind a writer thread and a few reader threads"""
+
+    name = "sqlite"
+
+    def __init__(self, shard_urls, readers=4, synchronous="NORMAL", cache_mb=64, busy_timeout=5.0):
+        if len(shard_urls) != 1:
+            raise ValueError("SQLite storage is a single database; unset SHARD_DATABASE_URLS")
+        self.shard_urls = shard_urls
+        self.path = sqlite_path(next(iter(shard_urls.values())))
+        self.readers = readers
+        self.options = {"synchronous": synchronous, "cache_mb": cache_mb, "busy_timeout": busy_timeout}
+        self._writer = None
+        self._reader_pool = None
+        self._local = threading.local()
+        self._connections = []
+        self._last_micros = 0
+        self._reading = 0
+        self._writing = 0
+        # Same counters as PostgresStorage; operations never wait for a connection
+        self.stats = {"acquired": 0, "wait_seconds": 0.0, "hold_seconds": 0.0}
+
+    @property
+    def shard_names(self):
+        return list(self.shard_urls)
+
+    @property
+    def sharded(self):
+        return False
+
+    def shard_for(self, form_number):
+        return self.shard_names[0]
+
+    def _open_thread_connection(self, read_only):
+        self._local.conn = connect(self.path, read_only=read_only, **self.options)
+        self._connections.append(self._local.conn)
+
+    async def create_pool(self):
+        """Start the writer thread (creating the database file) and the reader pool"""
+        if self._writer is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._writer = ThreadPoolExecutor(
+            1, thread_name_prefix="sqlite-writer",
+            initializer=self._open_thread_connection, initargs=(False,)
+        )
+        self._reader_pool = ThreadPoolExecutor(
+            self.readers, thread_name_prefix="sqlite-reader",
+            initializer=self._open_thread_connection, initargs=(True,)
+        )
+        # The writer connection switches the file to WAL before any reader opens it
+        await asyncio.wrap_future(self._writer.submit(lambda: None))
+        logger.info(f"SQLite database opened ({self.path}, readers={self.readers})")
+
+    async def open(self, auto_migrate=True):
+        """Open the database and bring its schema up to date (one PRAGMA read when it already is)"""
+        await self.create_pool()
+        version = await asyncio.wrap_future(self._writer.submit(lambda: current_version(self._local.conn)))
+        if version >= LATEST_VERSION:
+            return
+        if not auto_migrate:
+            raise RuntimeError(
+                f"SQLite schema is behind version {LATEST_VERSION}; run `python db_setup.py`"
+            )
+        await asyncio.wrap_future(self._writer.submit(lambda: migrate(self._local.conn)))
+
+    async def warm_up(self):
+        """Start every reader thread and open its connection so the first requests don't pay for it"""
+        barrier = threading.Barrier(self.readers)
+        await asyncio.gather(*(
+            asyncio.wrap_future(self._reader_pool.submit(barrier.wait, 5))
+            for _ in range(self.readers)
+        ))
+
+    def pool_status(self):
+        """Threads (readers plus the writer) and how many are free, like a pool's size and idle count"""
+        threads = self.readers + 1
+        return {
+            self.shard_names[0]: {
+                "size": threads,
+                "idle": max(0, threads - self._reading - self._writing),
+                "minSize": threads,
+                "maxSize": threads,
+                "writeQueue": self._writing,
+            }
+        }
+
+    async def close_pool(self):
+        if self._writer is None:
+            return
+        writer, readers = self._writer, self._reader_pool
+        self._writer = self._reader_pool = None
+        await asyncio.to_thread(readers.shutdown)
+        await asyncio.to_thread(writer.shutdown)
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+        logger.info("SQLite database closed")
+
+    @asynccontextmanager
+    async def connection(self, deadline_ms=None, shard=None):
+        """A session for the duration of the block; operations run on it share its deadline.
+
+        An operation still queued for its thread when the deadline passes raises
+        asyncio.TimeoutError, like waiting too long for a pooled connection; a
+        statement still running is interrupted and raises StatementTimeout.
+        """
+        if self._writer is None:
+            await self.create_pool()
+        started = time.perf_counter()
+        try:
+            yield _Session(deadline_ms)
+        finally:
+            self.stats["acquired"] += 1
+            self.stats["hold_seconds"] += time.perf_counter() - started
+
+    @asynccontextmanager
+    async def exclusive(self, key, wait=True):
+        """Hold the lock `key` across every process using this database for the block; yields whether it was taken.
+
+        SQLite has no advisory locks, so this is an flock() on a file beside
+        the database. Without `wait`, yields False at once while it is held.
+        """
+        with open(f"{self.path}.lock-{key:x}", "a") as lock_file:
+            def try_lock():
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return True
+                except BlockingIOError:
+                    return False
+
+            locked = try_lock()
+            while not locked and wait:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                locked = try_lock()
+            try:
+                yield locked
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def statement_logging(self, conn):
+        return nullcontext()
+
+    def _now(self):
+        """Increasing microsecond timestamp within this process (writer thread only).
+
+        Other processes writing the same file keep their own, so updates also
+        take at least the row's previous updated_at plus one. Sync does not
+        rely on timestamps; it follows change_seq.
+        """
+        self._last_micros = max(time.time_ns() // 1000, self._last_micros + 1)
+        return self._last_micros
+
+    def _call(self, fn, deadline, write, running):
+        """Run fn(conn) in one transaction on this worker thread's connection"""
+        conn = self._local.conn
+        if deadline is not None and time.monotonic() >= deadline:
+            raise asyncio.TimeoutError()
+        running.append(conn)
+        try:
+            def transaction():
+                conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+                try:
+                    result = fn(conn)
+                    conn.execute("COMMIT")
+                    return result
+                except BaseException:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+            return _with_deadline(conn, deadline, transaction)
+        finally:
+            running.clear()
+
+    async def _run(self, session, fn, write=False):
+        """Run fn(conn) on the writer thread or a reader thread"""
+        running = []
+        if write:
+            self._writing += 1
+        else:
+            self._reading += 1
+        try:
+            executor = self._writer if write else self._reader_pool
+            future = executor.submit(self._call, fn, session.deadline, write, running)
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                # The client went away: a queued operation never runs, a running one is interrupted
+                for conn in running:
+                    conn.interrupt()
+                raise
+        finally:
+            if write:
+                self._writing -= 1
+            else:
+                self._reading -= 1
+
+    async def list_forms(self, conn, form_filter, projection=None, limit=100, offset=0, sort_keys=False):
+        """A page of matching forms, newest first (best match first when searching)"""
+        where_clause, params = _where(form_filter)
+        source = _source(form_filter)
+        order_by = "created_at DESC"
+        sort_columns = ", created_at AS sort_created_at"
+        if form_filter.search:
+            # bm25 is lower for better matches
+            order_by = f"{SEARCH_RANK}, created_at DESC"
+            sort_columns += f", -{SEARCH_RANK} AS sort_rank"
+        if not sort_keys:
+            sort_columns = ""
+        query = f"""
+            SELECT {_select_list(projection)}{sort_columns}
+            FROM {source}
+            {where_clause}
+            ORDER BY {order_by}
+            LIMIT ? OFFSET ?
+        """
+        return await self._run(conn, lambda db: db.execute(query, (*params, limit, offset)).fetchall())
+
+    async def get_form(self, conn, form_number, projection=None):
+        query = f"""
+            SELECT {_select_list(projection)}
+            FROM wheel_specifications
+            WHERE form_number = ? AND deleted_at IS NULL
+        """
+        return await self._run(conn, lambda db: _one(db.execute(query, (form_number,))))
+
+    async def create_form(self, conn, form_number, submitted_by, submitted_date, fields):
+        """Insert a form; None when a live form already has the number"""
+        def insert(db):
+            # A soft-deleted form releases its number; drop the tombstone before reuse
+            db.execute(
+                "DELETE FROM wheel_specifications WHERE form_number = ? AND deleted_at IS NOT NULL",
+                (form_number,)
+            )
+            now = self._now()
+            return _one(db.execute(f"""
+                INSERT INTO wheel_specifications
+                (form_number, submitted_by, submitted_date, fields, created_at, updated_at, change_seq)
+                VALUES (?, ?, ?, json(?), ?, ?, ?)
+                ON CONFLICT (form_number) DO NOTHING
+                RETURNING {", ".join(COLUMNS)}
+            """, (
+                form_number, submitted_by, submitted_date.isoformat(), json.dumps(fields), now, now,
+                _next_change(db)
+            )))
+
+        return await self._run(conn, insert, write=True)
+
+    async def replace_form(self, conn, form_number, new_form_number, submitted_by, submitted_date, fields):
+        """Overwrite a live form, possibly renaming it; None when there is no such form"""
+        def replace(db):
+            existing = _one(db.execute(
+                "SELECT id FROM wheel_specifications WHERE form_number = ? AND deleted_at IS NULL",
+                (form_number,)
+            ))
+            if not existing:
+                return None
+            if new_form_number != form_number:
+                # Renaming onto a soft-deleted form number reuses it
+                db.execute(
+                    "DELETE FROM wheel_specifications WHERE form_number = ? AND deleted_at IS NOT NULL",
+                    (new_form_number,)
+                )
+            change = _next_change(db)
+            record = _one(db.execute(f"""
+                UPDATE wheel_specifications
+                SET form_number = ?, submitted_by = ?, submitted_date = ?,
+                    fields = json(?), updated_at = max(?, updated_at + 1), change_seq = ?
+                WHERE id = ?
+                RETURNING {", ".join(COLUMNS)}
+            """, (
+                new_form_number, submitted_by, submitted_date.isoformat(),
+                json.dumps(fields), self._now(), change, existing["id"]
+            )))
+            if new_form_number != form_number:
+                # The old number is gone, so sync deletes it centrally
+                updated_at = to_micros(record["updated_at"])
+                _bury(db, [(form_number, updated_at, updated_at)], change)
+            return record
+
+        return await self._run(conn, replace, write=True)
+
+    async def patch_form(self, conn, form_number, submitted_by, submitted_date, fields_changes,
+                         expected_updated_at=None):
+        """Change the given values, setting each key of `fields_changes` in the stored fields.
+
+        Returns None when there is no such live form, and raises VersionConflict
+        when `expected_updated_at` no longer matches.
+        """
+        # json_set keeps keys set to null, like Postgres' jsonb ||
+        assignments = "".join(f", '$.\"{key}\"', json(?)" for key in fields_changes)
+        expected = to_micros(expected_updated_at) if expected_updated_at else None
+
+        def patch(db):
+            record = _one(db.execute(f"""
+                UPDATE wheel_specifications
+                SET submitted_by = COALESCE(?, submitted_by),
+                    submitted_date = COALESCE(?, submitted_date),
+                    fields = json_set(fields{assignments}),
+                    updated_at = max(?, updated_at + 1),
+                    change_seq = ?
+                WHERE form_number = ? AND deleted_at IS NULL
+                  AND (? IS NULL OR updated_at = ?)
+                RETURNING {", ".join(COLUMNS)}
+            """, (
+                submitted_by, _iso(submitted_date),
+                *(json.dumps(value) for value in fields_changes.values()),
+                self._now(), _next_change(db), form_number, expected, expected
+            )))
+            if record:
+                return record
+            if _one(db.execute(
+                "SELECT 1 FROM wheel_specifications WHERE form_number = ? AND deleted_at IS NULL",
+                (form_number,)
+            )):
+                raise VersionConflict(form_number)
+            return None
+
+        return await self._run(conn, patch, write=True)
+
+    async def soft_delete_form(self, conn, form_number):
+        """Mark a live form deleted; returns its id, or None when there is no such form"""
+        def soft_delete(db):
+            record = _one(db.execute("""
+                UPDATE wheel_specifications
+                SET deleted_at = ?, change_seq = ?
+                WHERE form_number = ? AND deleted_at IS NULL
+                RETURNING id
+            """, (self._now(), _next_change(db), form_number)))
+            return record["id"] if record else None
+
+        return await self._run(conn, soft_delete, write=True)
+
+    async def soft_delete_matching(self, conn, form_filter, limit):
+        """Mark up to `limit` matching forms deleted; returns how many were"""
+        where_clause, params = _where(form_filter)
+
+        def soft_delete(db):
+            return db.execute(f"""
+                UPDATE wheel_specifications
+                SET deleted_at = ?, change_seq = ?
+                WHERE id IN (SELECT id FROM {_source(form_filter)} {where_clause} LIMIT ?)
+            """, (self._now(), _next_change(db), *params, limit)).rowcount
+
+        return await self._run(conn, soft_delete, write=True)
+
+    async def purge_deleted(self, conn, cutoff, limit):
+        """Physically remove up to `limit` rows soft-deleted before `cutoff`; returns how many were.
+
+        Each purged form leaves a tombstone, so a delete that was not synced
+        yet still reaches the central deployment.
+        """
+        def purge(db):
+            purged = db.execute("""
+                DELETE FROM wheel_specifications
+                WHERE id IN (
+                    SELECT id FROM wheel_specifications
+                    WHERE deleted_at IS NOT NULL AND deleted_at < ?
+                    LIMIT ?
+                )
+                RETURNING form_number, updated_at, deleted_at
+            """, (to_micros(cutoff), limit)).fetchall()
+            if purged:
+                _bury(db, [
+                    (row["form_number"], to_micros(row["updated_at"]), to_micros(row["deleted_at"]))
+                    for row in purged
+                ], _next_change(db))
+            return len(purged)
+
+        return await self._run(conn, purge, write=True)
+
+    async def create_job(self, conn, job_id, kind, criteria, owner):
+        """Record a new running job held by `owner`"""
+        def insert(db):
+            now = time.time_ns() // 1000
+            return _one(db.execute(f"""
+                INSERT INTO jobs (id, kind, criteria, owner, started_at, heartbeat_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                RETURNING {", ".join(JOB_COLUMNS)}
+            """, (job_id, kind, json.dumps(criteria), owner, now, now)))
+
+        return await self._run(conn, insert, write=True)
+
+    async def get_job(self, conn, job_id):
+        query = f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?"
+        return await self._run(conn, lambda db: _one(db.execute(query, (job_id,))))
+
+    async def save_job(self, conn, job_id, owner, processed, status="running", error=None, release=False):
+        """Record a job's progress, or its outcome once `status` is no longer running.
+
+        Only `owner` may write. Finishing, or `release`, gives the job up, so
+        another worker can resume a released job straight away.
+        """
+        def save(db):
+            now = time.time_ns() // 1000
+            record = _one(db.execute("""
+                UPDATE jobs
+                SET processed = ?, status = ?, error = ?, heartbeat_at = ?,
+                    finished_at = CASE WHEN ? = 'running' THEN NULL ELSE ? END,
+                    owner = CASE WHEN ? = 'running' AND NOT ? THEN owner END
+                WHERE id = ? AND owner = ?
+                RETURNING id
+            """, (processed, status, error, now, status, now, status, release, job_id, owner)))
+            return record["id"] if record else None
+
+        return await self._run(conn, save, write=True)
+
+    async def claim_job(self, conn, owner, stale_seconds):
+        """Take over one running job that was released or whose owner stopped reporting; None when there is none"""
+        def claim(db):
+            now = time.time_ns() // 1000
+            return _one(db.execute(f"""
+                UPDATE jobs
+                SET owner = ?, heartbeat_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = 'running' AND (owner IS NULL OR heartbeat_at < ?)
+                    ORDER BY started_at
+                    LIMIT 1
+                )
+                RETURNING {", ".join(JOB_COLUMNS)}
+            """, (owner, now, now - int(stale_seconds * 1_000_000))))
+
+        return await self._run(conn, claim, write=True)
+
+    async def purge_jobs(self, conn, cutoff):
+        """Forget jobs that finished before `cutoff`; returns how many there were"""
+        return await self._run(conn, lambda db: db.execute(
+            "DELETE FROM jobs WHERE status <> 'running' AND finished_at < ?", (to_micros(cutoff),)
+        ).rowcount, write=True)
+
+    async def export_batches(self, conn, export_schema, form_filter, batch_size):
+        """Yield lists of up to `batch_size` rows in export column order.
+
+        The export reads one snapshot through its own connection, so it holds
+        no reader thread between batches. The deadline applies to each batch.
+        """
+        expressions = [f'{column} AS "{name}"' for name, column, _ in export_schema.base_columns]
+        for key, arrow_type in export_schema.field_columns:
+            expression = f"fields ->> '$.\"{key}\"'"
+            if arrow_type in _EXPORT_CASTS:
+                expression = f"CAST({expression} AS {_EXPORT_CASTS[arrow_type]})"
+            expressions.append(f'{expression} AS "{key}"')
+        where_clause, params = _where(form_filter)
+        query = f"SELECT {', '.join(expressions)} FROM {_source(form_filter)} {where_clause} ORDER BY id"
+
+        converters = {"timestamp": from_micros, "date32": date.fromisoformat, "bool": bool}
+        convert = [
+            converters.get(arrow_type)
+            for arrow_type in [t for _, _, t in export_schema.base_columns] + [t for _, t in export_schema.field_columns]
+        ]
+
+        def fetch(cursor):
+            deadline = time.monotonic() + conn.deadline_ms / 1000 if conn.deadline_ms else None
+            rows = _with_deadline(db, deadline, cursor.fetchmany, batch_size)
+            return [
+                tuple(f(value) if f and value is not None else value for f, value in zip(convert, row))
+                for row in rows
+            ]
+
+        def start():
+            db.row_factory = None
+            db.execute("BEGIN")
+            return db.execute(query, params)
+
+        db = await asyncio.to_thread(connect, self.path, True, **self.options)
+        try:
+            cursor = await asyncio.to_thread(start)
+            while True:
+                rows = await asyncio.to_thread(fetch, cursor)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            db.interrupt()
+            await asyncio.to_thread(db.close)
+
+
+SYNC_COLUMNS = ("form_number", "submitted_by", "submitted_date", "fields", "created_at", "updated_at", "deleted_at")
+
+
+def _target_key(shard_urls):
+    """Identifies a central deployment in sync_state without its credentials"""
+    return ",".join(
+        f"{parts.hostname}:{parts.port or 5432}{parts.path}"
+        for parts in (urlsplit(url) for url in shard_urls.values())
+    )
+
+
+async def _upsert(conn, records):
+    """COPY records into a temporary table, then merge them into wheel_specifications"""
+    columns = ", ".join(SYNC_COLUMNS)
+    async with conn.transaction():
+        await conn.execute("""
+            CREATE TEMPORARY TABLE wheel_specifications_sync (
+                form_number VARCHAR(100),
+                submitted_by VARCHAR(100),
+                submitted_date DATE,
+                fields JSONB,
+                created_at TIMESTAMP WITH TIME ZONE,
+                updated_at TIMESTAMP WITH TIME ZONE,
+                deleted_at TIMESTAMP WITH TIME ZONE
+            ) ON COMMIT DROP
+        """)
+        await conn.copy_records_to_table("wheel_specifications_sync", records=records, columns=SYNC_COLUMNS)
+        # A form changed centrally after the depot's last change keeps the central version
+        await conn.execute(f"""
+            INSERT INTO wheel_specifications ({columns})
+            SELECT {columns} FROM wheel_specifications_sync
+            ON CONFLICT (form_number) DO UPDATE SET
+                submitted_by = EXCLUDED.submitted_by,
+                submitted_date = EXCLUDED.submitted_date,
+                fields = EXCLUDED.fields,
+                created_at = EXCLUDED.created_at,
+                updated_at = EXCLUDED.updated_at,
+                deleted_at = EXCLUDED.deleted_at
+            WHERE EXCLUDED.updated_at >= wheel_specifications.updated_at
+        """)
+
+
+async def _delete_buried(conn, tombstones):
+    """Soft-delete central forms that left the depot, unless changed centrally since"""
+    await conn.execute("""
+        UPDATE wheel_specifications AS w
+        SET deleted_at = t.deleted_at
+        FROM unnest($1::varchar[], $2::timestamptz[], $3::timestamptz[]) AS t(form_number, updated_at, deleted_at)
+        WHERE w.form_number = t.form_number AND w.deleted_at IS NULL AND w.updated_at <= t.updated_at
+    """, *map(list, zip(*tombstones)))
+
+
+async def sync_to_postgres(path, shard_urls, vnodes=64, batch_size=5000, full=False):
+    """Push forms changed since the last sync from a depot database to a central Postgres deployment.
+
+    Changes are read from one snapshot by change_seq, the counter every write
+    transaction advances, so rows written by any process are pushed exactly
+    when they commit, whatever their timestamps. Tombstones of forms purged or
+    renamed away on the depot are applied first, as soft deletes. Changed rows
+    follow in batches, routed to the shard that owns their form number, COPYed
+    into a temporary table there and merged in. The last change pushed is
+    recorded per target, so the next run sends only later ones; `full`
+    resends everything. Tombstones every target has received are dropped.
+    Returns {shard: rows pushed}.
+    """
+    ring = HashRing(shard_urls, vnodes=vnodes)
+    target = _target_key(shard_urls)
+    source = await asyncio.to_thread(connect, path)
+    source.row_factory = None
+    connections = {name: await asyncpg.connect(url) for name, url in shard_urls.items()}
+    pushed = {name: 0 for name in shard_urls}
+    try:
+        for conn in connections.values():
+            await migrations.ensure_schema(conn)
+
+        def start():
+            source.execute("BEGIN")
+            row = source.execute("SELECT synced_seq FROM sync_state WHERE target = ?", (target,)).fetchone()
+            since = row[0] if row and not full else 0
+            newest = source.execute("SELECT value FROM sync_seq").fetchone()[0]
+            tombstones = source.execute("""
+                SELECT form_number, updated_at, deleted_at FROM sync_tombstones
+                WHERE change_seq > ? AND change_seq <= ?
+            """, (since, newest)).fetchall()
+            cursor = source.execute(f"""
+                SELECT {", ".join(SYNC_COLUMNS)} FROM wheel_specifications
+                WHERE change_seq > ? AND change_seq <= ?
+                ORDER BY change_seq
+            """, (since, newest))
+            return since, newest, tombstones, cursor
+
+        since, newest, tombstones, cursor = await asyncio.to_thread(start)
+
+        buried = {}
+        for form_number, updated_at, deleted_at in tombstones:
+            buried.setdefault(ring.shard_for(form_number), []).append(
+                (form_number, from_micros(updated_at), from_micros(deleted_at))
+            )
+        for name, forms in buried.items():
+            await _delete_buried(connections[name], forms)
+        if tombstones:
+            logger.info(f"Pushed {len(tombstones)} deletes of purged or renamed forms")
+
+        while True:
+            rows = await asyncio.to_thread(cursor.fetchmany, batch_size)
+            if not rows:
+                break
+            batches = {}
+            for form_number, submitted_by, submitted_date, fields, created_at, updated_at, deleted_at in rows:
+                batches.setdefault(ring.shard_for(form_number), []).append((
+                    form_number, submitted_by, date.fromisoformat(submitted_date), fields,
+                    from_micros(created_at), from_micros(updated_at),
+                    from_micros(deleted_at) if deleted_at is not None else None,
+                ))
+            for name, records in batches.items():
+                await _upsert(connections[name], records)
+                pushed[name] += len(records)
+            logger.info(f"Pushed {len(rows)} rows")
+
+        def record_progress():
+            source.execute("COMMIT")
+            if newest > since:
+                source.execute("BEGIN IMMEDIATE")
+                source.execute("""
+                    INSERT INTO sync_state (target, synced_seq) VALUES (?, ?)
+                    ON CONFLICT (target) DO UPDATE SET synced_seq = excluded.synced_seq
+                """, (target, newest))
+                source.execute("""
+                    DELETE FROM sync_tombstones
+                    WHERE change_seq <= (SELECT min(synced_seq) FROM sync_state)
+                """)
+                source.execute("COMMIT")
+
+        await asyncio.to_thread(record_progress)
+    finally:
+        await asyncio.gather(*(conn.close() for conn in connections.values()))
+        await asyncio.to_thread(source.close)
+    return pushed
@@ -0,0 +1,578 @@
+"""
+Storage backends for wheel_specifications.
+
+Route handlers don't issue SQL themselves. They run a backend's operations
+on the connection that `backend.connection(deadline_ms, shard)` yields, so
+admission, deadlines, read coalescing and disconnect handling in app.py work
+the same whatever the backend:
+
+* PostgresStorage: asyncpg pools, one per shard (the default).
+* SQLiteStorage (sqlite_storage.py): one embedded database file for small
+  single-box deployments, selected by a sqlite:// DATABASE_URL.
+
+Operations return row mappings keyed by column name, with `fields` as JSON
+text, dates and timezone-aware datetimes, or None when the form doesn't
+exist. A query that overruns its connection's deadline raises
+StatementTimeout.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Optional, Tuple
+
+import asyncpg
+
+import migrations
+import tracing
+from sharding import HashRing
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("id", "form_number", "submitted_by", "submitted_date", "fields", "created_at", "updated_at")
+
+JOB_COLUMNS = ("id", "kind", "status", "processed", "criteria", "error", "started_at", "finished_at")
+
+# Seconds between attempts to take a held advisory lock
+LOCK_POLL_INTERVAL = 1.0
+
+# application_name of pooled connections, so tools can tell whether the API is running
+APPLICATION_NAME = "wheel-specifications-api"
+
+
+class StatementTimeout(Exception):
+    """A query ran past its connection's deadline and was cancelled"""
+
+
+class VersionConflict(Exception):
+    """A conditional update found the form modified since the expected version"""
+
+
+@dataclass(frozen=True)
+class Projection:
+    """Columns and `fields` keys a read returns (None instead of a Projection means every column).
+
+    Requested `fields` keys are returned as a `fields` object holding just
+    those keys, unless the whole `fields` column is selected too.
+    """
+    columns: Tuple[str, ...] = ()
+    field_keys: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class FormFilter:
+    """Live forms selected by a list, export or bulk delete"""
+    form_number_contains: Optional[str] = None
+    submitted_by_contains: Optional[str] = None
+    submitted_by: Optional[str] = None
+    submitted_date: Optional[date] = None
+    submitted_from: Optional[date] = None
+    submitted_to: Optional[date] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    # Full-text search terms, each matched as a prefix; matches are ranked
+    search: Tuple[str, ...] = ()
+
+
+# updated_at doubles as the ETag version, so every write must move it forward.
+# CURRENT_TIMESTAMP is the transaction's start time; the wall clock is not
+# monotonic, hence the one-microsecond floor.
+_NEXT_UPDATED_AT = "GREATEST(clock_timestamp(), updated_at + interval '1 microsecond')"
+
+# Arrow type of an export column -> cast applied to the ->> text
+_EXPORT_CASTS = {"int64": "bigint", "float64": "double precision", "bool": "boolean", "date32": "date"}
+
+
+def _select_list(projection):
+    if projection is None:
+        return ", ".join(COLUMNS)
+    columns = list(projection.columns)
+    # Keys were checked against the fields model by the caller, so they are safe to inline
+    if projection.field_keys and "fields" not in columns:
+        pairs = ", ".join(f"'{key}', fields->'{key}'" for key in projection.field_keys)
+        columns.append(f"jsonb_build_object({pairs}) AS fields")
+    return ", ".join(columns)
+
+
+def _where(form_filter):
+    """WHERE clause and parameters; the search condition, if any, uses the last parameter"""
+    conditions = ["deleted_at IS NULL"]
+    params = []
+    filters = [
+        ("form_number ILIKE", f"%{form_filter.form_number_contains}%" if form_filter.form_number_contains else None),
+        ("submitted_by ILIKE", f"%{form_filter.submitted_by_contains}%" if form_filter.submitted_by_contains else None),
+        ("submitted_by =", form_filter.submitted_by),
+        ("submitted_date =", form_filter.submitted_date),
+        # Range filters (created_at is served by its BRIN index)
+        ("submitted_date >=", form_filter.submitted_from),
+        ("submitted_date <=", form_filter.submitted_to),
+        ("created_at >=", form_filter.created_from),
+        ("created_at <=", form_filter.created_to),
+    ]
+    for condition, value in filters:
+        if value is not None:
+            params.append(value)
+            conditions.append(f"{condition} ${len(params)}")
+    if form_filter.search:
+        params.append(" & ".join(f"{term}:*" for term in form_filter.search))
+        conditions.append(f"search_vector @@ to_tsquery('simple', ${len(params)})")
+    return "WHERE " + " AND ".join(conditions), params
+
+
+async def create_database_if_missing(database_url):
+    """Create the database named in `database_url` when it does not exist yet"""
+    try:
+        # First, try to connect to the database
+        conn = await asyncpg.connect(database_url)
+        await conn.close()
+        logger.info("Connected to existing database")
+    except Exception as e:
+        logger.info(f"Database connection failed: {e}")
+        # Try to create the database
+        try:
+            # Extract database name from URL
+            db_name = database_url.split('/')[-1]
+            base_url = database_url.rsplit('/', 1)[0]
+
+            # Connect to postgres database to create our target database
+            postgres_url = f"{base_url}/postgres"
+            conn = await asyncpg.connect(postgres_url)
+
+            # Check if database exists
+            db_exists = await conn.fetchval(
+                "SELECT 1 FROM pg_database WHERE datname = $1", db_name
+            )
+
+            if not db_exists:
+                try:
+                    await conn.execute(f'CREATE DATABASE "{db_name}"')
+                    logger.info(f"Created database: {db_name}")
+                except (asyncpg.DuplicateDatabaseError, asyncpg.UniqueViolationError):
+                    # Another worker created it first
+                    pass
+
+            await conn.close()
+        except Exception as create_error:
+            logger.error(f"Failed to create database: {create_error}")
+            raise
+
+
+class PostgresStorage:
+    """Connection pools, one per shard, and the queries behind every route"""
+
+    name = "postgresql"
+
+    def __init__(self, shard_urls, vnodes=64, pool_min_size=5, pool_max_size=10):
+        self.shard_urls = shard_urls
+        self.ring = HashRing(shard_urls, vnodes=vnodes)
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        self.pools = {}
+        # Acquired connection -> (time.monotonic() deadline, deadline_ms) of its block
+        self._deadlines = {}
+        # Cumulative acquire/hold timings, used by benchmark.py to report pool occupancy
+        self.stats = {"acquired": 0, "wait_seconds": 0.0, "hold_seconds": 0.0}
+
+    @property
+    def shard_names(self):
+        return list(self.shard_urls)
+
+    @property
+    def sharded(self):
+        return len(self.shard_urls) > 1
+
+    def shard_for(self, form_number):
+        """Shard that owns `form_number`"""
+        return self.ring.shard_for(form_number)
+
+    async def create_pool(self):
+        try:
+            for name, url in self.shard_urls.items():
+                if name not in self.pools:
+                    self.pools[name] = await asyncpg.create_pool(
+                        url,
+                        min_size=min(self.pool_min_size, self.pool_max_size),
+                        max_size=self.pool_max_size,
+                        server_settings={"application_name": APPLICATION_NAME}
+                    )
+            logger.info(
+                f"Database connection pool created successfully "
+                f"(shards={len(self.pools)}, max_size={self.pool_max_size})"
+            )
+        except Exception as e:
+            logger.error(f"Failed to create database pool: {e}")
+            raise
+
+    async def open(self, auto_migrate=True):
+        """Open every shard's pool and bring its schema up to date.
+
+        Normally this is a single schema-version check per shard; databases that
+        don't exist yet are created first.
+        """
+        try:
+            await self.create_pool()
+        except asyncpg.InvalidCatalogNameError:
+            for url in self.shard_urls.values():
+                await create_database_if_missing(url)
+            await self.create_pool()
+
+        for name in self.shard_names:
+            async with self.connection(shard=name) as conn:
+                if auto_migrate:
+                    await migrations.ensure_schema(conn)
+                elif await migrations.current_version(conn) < migrations.LATEST_VERSION:
+                    raise RuntimeError(
+                        f"Shard {name} schema is behind version {migrations.LATEST_VERSION}; "
+                        f"run `python db_setup.py`"
+                    )
+
+    async def warm_up(self):
+        """Open and check every pool's minimum connections so the first requests don't pay for them"""
+        for pool in self.pools.values():
+            connections = [await pool.acquire() for _ in range(pool.get_min_size())]
+            try:
+                await asyncio.gather(*(conn.fetchval("SELECT 1") for conn in connections))
+            finally:
+                for conn in connections:
+                    await pool.release(conn)
+
+    def pool_status(self):
+        """Size and idle connections of each shard's pool"""
+        return {
+            name: {
+                "size": pool.get_size(),
+                "idle": pool.get_idle_size(),
+                "minSize": pool.get_min_size(),
+                "maxSize": pool.get_max_size(),
+            }
+            for name, pool in self.pools.items()
+        }
+
+    async def close_pool(self):
+        if self.pools:
+            await asyncio.gather(*(pool.close() for pool in self.pools.values()))
+            self.pools = {}
+            logger.info("Database connection pool closed")
+
+    @asynccontextmanager
+    async def connection(self, deadline_ms=None, shard=None):
+        """Acquire a pooled connection for the duration of the block only.
+
+        `shard` defaults to the only shard when sharding is off. With a deadline,
+        waiting for the pool raises asyncio.TimeoutError once it expires, and each
+        query in the block gets the remaining budget as asyncpg's client-side
+        timeout, which cancels it on the server when it runs out.
+        """
+        if not self.pools:
+            await self.create_pool()
+        if shard is None:
+            if self.sharded:
+                raise ValueError("A shard is required when sharding is enabled")
+            shard = self.shard_names[0]
+        pool = self.pools[shard]
+        started = time.perf_counter()
+        deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms else None
+        timeout = deadline_ms / 1000 if deadline_ms else None
+        with tracing.span("db.acquire", shard=shard):
+            conn = await pool.acquire(timeout=timeout)
+        acquired = time.perf_counter()
+        if deadline_ms:
+            self._deadlines[conn] = (deadline, deadline_ms)
+        try:
+            yield conn
+        except (asyncio.TimeoutError, asyncpg.exceptions.QueryCanceledError) as e:
+            raise StatementTimeout(str(e) or f"Query exceeded the {deadline_ms}ms deadline") from e
+        finally:
+            self._deadlines.pop(conn, None)
+            await pool.release(conn)
+            self.stats["acquired"] += 1
+            self.stats["wait_seconds"] += acquired - started
+            self.stats["hold_seconds"] += time.perf_counter() - acquired
+
+    def _timeout(self, conn):
+        """Seconds left before the deadline of the block holding `conn` (None without one)"""
+        if conn not in self._deadlines:
+            return None
+        remaining = self._deadlines[conn][0] - time.monotonic()
+        if remaining <= 0:
+            raise StatementTimeout(f"Query exceeded the {self._deadlines[conn][1]}ms deadline")
+        return remaining
+
+    @asynccontextmanager
+    async def exclusive(self, key, wait=True):
+        """Hold the deployment-wide advisory lock `key` for the block; yields whether it was taken.
+
+        The lock lives on the first shard and holds one of its pooled
+        connections. Without `wait`, yields False at once while another
+        session holds it.
+        """
+        async with self.connection(shard=self.shard_names[0]) as conn:
+            locked = await conn.fetchval("SELECT pg_try_advisory_lock($1)", key)
+            while not locked and wait:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                locked = await conn.fetchval("SELECT pg_try_advisory_lock($1)", key)
+            try:
+                yield locked
+            finally:
+                if locked:
+                    await conn.execute("SELECT pg_advisory_unlock($1)", key)
+
+    def statement_logging(self, conn):
+        """Record each statement run on `conn` inside the block as a tracing span"""
+        return conn.query_logger(tracing.statement_logger)
+
+    async def list_forms(self, conn, form_filter, projection=None, limit=100, offset=0, sort_keys=False):
+        """A page of matching forms, newest first (best match first when searching).
+
+        With `sort_keys`, rows also carry sort_created_at (and sort_rank when
+        searching) so pages from several shards can be merged.
+        """
+        where_clause, params = _where(form_filter)
+        order_by = "created_at DESC"
+        sort_columns = ", created_at AS sort_created_at"
+        if form_filter.search:
+            rank = f"ts_rank(search_vector, to_tsquery('simple', ${len(params)}))"
+            order_by = f"{rank} DESC, created_at DESC"
+            sort_columns += f", {rank} AS sort_rank"
+        if not sort_keys:
+            sort_columns = ""
+
+        return await conn.fetch(f"""
+            SELECT {_select_list(projection)}{sort_columns}
+            FROM wheel_specifications
+            {where_clause}
+            ORDER BY {order_by}
+            LIMIT ${len(params) + 1} OFFSET ${len(params) + 2}
+        """, *params, limit, offset, timeout=self._timeout(conn))
+
+    async def get_form(self, conn, form_number, projection=None):
+        return await conn.fetchrow(f"""
+            SELECT {_select_list(projection)}
+            FROM wheel_specifications
+            WHERE form_number = $1 AND deleted_at IS NULL
+        """, form_number, timeout=self._timeout(conn))
+
+    async def create_form(self, conn, form_number, submitted_by, submitted_date, fields):
+        """Insert a form; None when a live form already has the number"""
+        # A soft-deleted form releases its number; drop the tombstone before reuse
+        await conn.execute(
+            "DELETE FROM wheel_specifications WHERE form_number = $1 AND deleted_at IS NOT NULL",
+            form_number,
+            timeout=self._timeout(conn)
+        )
+
+        # Insert new record - let PostgreSQL handle the JSONB conversion. A live
+        # form with the number (even one inserted concurrently) returns no row
+        return await conn.fetchrow(f"""
+            INSERT INTO wheel_specifications
+            (form_number, submitted_by, submitted_date, fields)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (form_number) DO NOTHING
+            RETURNING {", ".join(COLUMNS)}
+        """,
+            form_number,
+            submitted_by,
+            submitted_date,
+            json.dumps(fields),
+            timeout=self._timeout(conn)
+        )
+
+    async def replace_form(self, conn, form_number, new_form_number, submitted_by, submitted_date, fields):
+        """Overwrite a live form, possibly renaming it; None when there is no such form.
+
+        Renames must stay on the form's shard; the API rejects the others.
+        """
+        async with conn.transaction():
+            # Lock the form first, so the tombstone delete and update see it unchanged
+            existing = await conn.fetchrow(
+                "SELECT id FROM wheel_specifications WHERE form_number = $1 AND deleted_at IS NULL FOR UPDATE",
+                form_number,
+                timeout=self._timeout(conn)
+            )
+            if not existing:
+                return None
+
+            if new_form_number != form_number:
+                # Renaming onto a soft-deleted form number reuses it
+                await conn.execute(
+                    "DELETE FROM wheel_specifications WHERE form_number = $1 AND deleted_at IS NOT NULL",
+                    new_form_number,
+                    timeout=self._timeout(conn)
+                )
+
+            # Update record
+            return await conn.fetchrow(f"""
+                UPDATE wheel_specifications
+                SET form_number = $1, submitted_by = $2, submitted_date = $3,
+                    fields = $4, updated_at = {_NEXT_UPDATED_AT}
+                WHERE id = $5
+                RETURNING {", ".join(COLUMNS)}
+            """,
+                new_form_number,
+                submitted_by,
+                submitted_date,
+                json.dumps(fields),
+                existing["id"],
+                timeout=self._timeout(conn)
+            )
+
+    async def patch_form(self, conn, form_number, submitted_by, submitted_date, fields_changes,
+                         expected_updated_at=None):
+        """Change the given values, merging `fields_changes` into the stored fields.
+
+        Returns None when there is no such live form, and raises VersionConflict
+        when `expected_updated_at` no longer matches.
+        """
+        record = await conn.fetchrow(f"""
+            UPDATE wheel_specifications
+            SET submitted_by = COALESCE($2, submitted_by),
+                submitted_date = COALESCE($3, submitted_date),
+                fields = fields || $4::jsonb,
+                updated_at = {_NEXT_UPDATED_AT}
+            WHERE form_number = $1 AND deleted_at IS NULL
+              AND ($5::timestamptz IS NULL OR updated_at = $5)
+            RETURNING {", ".join(COLUMNS)}
+        """,
+            form_number,
+            submitted_by,
+            submitted_date,
+            json.dumps(fields_changes),
+            expected_updated_at,
+            timeout=self._timeout(conn)
+        )
+        if record:
+            return record
+
+        exists = await conn.fetchval(
+            "SELECT 1 FROM wheel_specifications WHERE form_number = $1 AND deleted_at IS NULL",
+            form_number,
+            timeout=self._timeout(conn)
+        )
+        if exists:
+            raise VersionConflict(form_number)
+        return None
+
+    async def soft_delete_form(self, conn, form_number):
+        """Mark a live form deleted; returns its id, or None when there is no such form"""
+        return await conn.fetchval("""
+            UPDATE wheel_specifications
+            SET deleted_at = CURRENT_TIMESTAMP
+            WHERE form_number = $1 AND deleted_at IS NULL
+            RETURNING id
+        """, form_number, timeout=self._timeout(conn))
+
+    async def soft_delete_matching(self, conn, form_filter, limit):
+        """Mark up to `limit` matching forms deleted; returns how many were"""
+        where_clause, params = _where(form_filter)
+        status = await conn.execute(f"""
+            UPDATE wheel_specifications
+            SET deleted_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM wheel_specifications
+                {where_clause}
+                LIMIT ${len(params) + 1}
+                FOR UPDATE SKIP LOCKED
+            )
+        """, *params, limit, timeout=self._timeout(conn))
+        return int(status.split()[-1])
+
+    async def purge_deleted(self, conn, cutoff, limit):
+        """Physically remove up to `limit` rows soft-deleted before `cutoff`; returns how many were"""
+        status = await conn.execute("""
+            DELETE FROM wheel_specifications
+            WHERE id IN (
+                SELECT id FROM wheel_specifications
+                WHERE deleted_at IS NOT NULL AND deleted_at < $1
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+        """, cutoff, limit, timeout=self._timeout(conn))
+        return int(status.split()[-1])
+
+    async def create_job(self, conn, job_id, kind, criteria, owner):
+        """Record a new running job held by `owner`"""
+        return await conn.fetchrow(f"""
+            INSERT INTO jobs (id, kind, criteria, owner)
+            VALUES ($1, $2, $3, $4)
+            RETURNING {", ".join(JOB_COLUMNS)}
+        """, job_id, kind, json.dumps(criteria), owner, timeout=self._timeout(conn))
+
+    async def get_job(self, conn, job_id):
+        return await conn.fetchrow(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = $1",
+            job_id,
+            timeout=self._timeout(conn)
+        )
+
+    async def save_job(self, conn, job_id, owner, processed, status="running", error=None, release=False):
+        """Record a job's progress, or its outcome once `status` is no longer running.
+
+        Only `owner` may write. Finishing, or `release`, gives the job up, so
+        another worker can resume a released job straight away.
+        """
+        return await conn.fetchval("""
+            UPDATE jobs
+            SET processed = $3, status = $4::varchar, error = $5, heartbeat_at = CURRENT_TIMESTAMP,
+                finished_at = CASE WHEN $4::varchar = 'running' THEN NULL ELSE CURRENT_TIMESTAMP END,
+                owner = CASE WHEN $4::varchar = 'running' AND NOT $6 THEN owner END
+            WHERE id = $1 AND owner = $2
+            RETURNING id
+        """, job_id, owner, processed, status, error, release, timeout=self._timeout(conn))
+
+    async def claim_job(self, conn, owner, stale_seconds):
+        """Take over one running job that was released or whose owner stopped reporting; None when there is none"""
+        return await conn.fetchrow(f"""
+            UPDATE jobs
+            SET owner = $1, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = 'running'
+                  AND (owner IS NULL OR heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => $2))
+                ORDER BY started_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {", ".join(JOB_COLUMNS)}
+        """, owner, stale_seconds, timeout=self._timeout(conn))
+
+    async def purge_jobs(self, conn, cutoff):
+        """Forget jobs that finished before `cutoff`; returns how many there were"""
+        status = await conn.execute(
+            "DELETE FROM jobs WHERE status <> 'running' AND finished_at < $1",
+            cutoff,
+            timeout=self._timeout(conn)
+        )
+        return int(status.split()[-1])
+
+    async def export_batches(self, conn, export_schema, form_filter, batch_size):
+        """Yield lists of up to `batch_size` rows in export column order from a server-side cursor.
+
+        Each `fields` key is extracted in SQL with ->>, so the JSONB is never
+        parsed in Python. The connection's deadline applies to each batch.
+        """
+        expressions = [f'{column} AS "{name}"' for name, column, _ in export_schema.base_columns]
+        for key, arrow_type in export_schema.field_columns:
+            expression = f"fields->>'{key}'"
+            if arrow_type in _EXPORT_CASTS:
+                expression = f"({expression})::{_EXPORT_CASTS[arrow_type]}"
+            expressions.append(f'{expression} AS "{key}"')
+        where_clause, params = _where(form_filter)
+        query = f"""
+            SELECT {", ".join(expressions)}
+            FROM wheel_specifications
+            {where_clause}
+            ORDER BY id
+        """
+        timeout = self._deadlines[conn][1] / 1000 if conn in self._deadlines else None
+        # Cursors only live inside a transaction
+        async with conn.transaction():
+            cursor = await conn.cursor(query, *params, timeout=timeout)
+            while True:
+                rows = await cursor.fetch(batch_size, timeout=timeout)
+                if not rows:
+                    return
+                yield rows
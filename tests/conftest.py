@@ -0,0 +1,31 @@
+import asyncio
+
+import httpx
+import pytest
+
+from coalescing import SingleFlight
+from sqlite_storage import SQLiteStorage
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """Run `await scenario(client)` against the app, backed by a fresh SQLite database"""
+    import app
+
+    storage = SQLiteStorage({app.db_manager.shard_names[0]: f"sqlite:///{tmp_path}/forms.db"})
+    monkeypatch.setattr(app, "db_manager", storage)
+    monkeypatch.setattr(app, "read_flights", SingleFlight())
+
+    def run(scenario):
+        async def main():
+            await storage.open()
+            try:
+                transport = httpx.ASGITransport(app=app.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    return await scenario(client)
+            finally:
+                await storage.close_pool()
+
+        return asyncio.run(main())
+
+    return run
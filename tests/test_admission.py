@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionRejected, RoutePolicy
+
+
+def controller(capacity=1, max_queue=100, **policies):
+    return AdmissionController(capacity, policies, max_queue=max_queue)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_free_slots_go_to_the_highest_priority_waiter():
+    async def scenario():
+        ctl = controller(low=RoutePolicy(limit=1, priority=1, target_wait_ms=1000),
+                         high=RoutePolicy(limit=1, priority=0, target_wait_ms=1000),
+                         hold=RoutePolicy(limit=1, priority=0, target_wait_ms=1000))
+        served = []
+
+        async def request(route):
+            async with ctl.admit(route):
+                served.append(route)
+
+        async with ctl.admit("hold"):
+            tasks = [asyncio.create_task(request("low"))]
+            await settle()
+            tasks.append(asyncio.create_task(request("high")))
+            await settle()
+            assert ctl.metrics()["queued"] == 2
+        await asyncio.gather(*tasks)
+        return ctl, served
+
+    ctl, served = asyncio.run(scenario())
+    assert served == ["high", "low"]
+    assert ctl.in_flight == 0
+
+
+def test_full_queue_evicts_a_lower_priority_waiter():
+    async def scenario():
+        ctl = controller(max_queue=1,
+                         low=RoutePolicy(limit=1, priority=1, target_wait_ms=1000),
+                         high=RoutePolicy(limit=1, priority=0, target_wait_ms=1000))
+        served = []
+
+        async def request(route):
+            async with ctl.admit(route):
+                served.append(route)
+
+        async with ctl.admit("high"):
+            low = asyncio.create_task(request("low"))
+            await settle()
+            high = asyncio.create_task(request("high"))
+            await settle()
+            with pytest.raises(AdmissionRejected, match="evicted"):
+                await low
+            assert not high.done()
+        await high
+        return ctl, served
+
+    ctl, served = asyncio.run(scenario())
+    assert served == ["high"]
+    assert ctl.counters["low"]["shed"] == 1
+    assert ctl.in_flight == 0
+
+
+def test_sheds_when_the_service_time_average_exceeds_the_target():
+    async def scenario():
+        ctl = controller(forms=RoutePolicy(limit=1, target_wait_ms=10))
+        async with ctl.admit("forms"):
+            await asyncio.sleep(0.05)
+        assert ctl.service_ewma["forms"] >= 0.05
+        async with ctl.admit("forms"):
+            with pytest.raises(AdmissionRejected, match="estimated wait") as rejected:
+                async with ctl.admit("forms"):
+                    pass
+        return ctl, rejected.value
+
+    ctl, rejected = asyncio.run(scenario())
+    assert rejected.retry_after >= 1
+    assert ctl.counters["forms"]["shed"] == 1
+    assert ctl.counters["forms"]["queued"] == 0
+    assert ctl.in_flight == 0
+
+
+def test_slot_granted_as_the_wait_times_out_is_given_back(monkeypatch):
+    async def scenario():
+        ctl = controller(forms=RoutePolicy(limit=1, target_wait_ms=1000))
+        holder = ctl.admit("forms")
+        await holder.__aenter__()
+
+        async def wait_for_racing_release(awaitable, timeout):
+            # The holder releases, and _wake() grants the waiter, in the same
+            # loop iteration in which the wait times out
+            await holder.__aexit__(None, None, None)
+            awaitable.cancel()
+            raise asyncio.TimeoutError
+
+        monkeypatch.setattr(admission.asyncio, "wait_for", wait_for_racing_release)
+        with pytest.raises(AdmissionRejected, match="queue wait exceeded"):
+            async with ctl.admit("forms"):
+                pass
+        monkeypatch.undo()
+
+        assert ctl.in_flight == 0
+        assert ctl.route_in_flight["forms"] == 0
+        async with ctl.admit("forms"):
+            assert ctl.in_flight == 1
+        return ctl
+
+    ctl = asyncio.run(scenario())
+    assert ctl.counters["forms"]["timed_out"] == 1
+    assert ctl.in_flight == 0
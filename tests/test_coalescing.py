@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from coalescing import SingleFlight
+
+
+class Query:
+    """Counts executions; each one waits until `release` is set"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await self.release.wait()
+        return call
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_identical_reads_share_one_execution():
+    async def scenario():
+        flights, query = SingleFlight(), Query()
+        readers = [asyncio.create_task(flights.do("forms", query)) for _ in range(5)]
+        other = asyncio.create_task(flights.do("other", query))
+        await settle()
+        query.release.set()
+        return flights, query, await asyncio.gather(*readers), await other
+
+    flights, query, results, other = asyncio.run(scenario())
+    assert results == [results[0]] * 5
+    assert other != results[0]
+    assert query.calls == 2
+    assert flights.stats == {"executions": 2, "coalesced": 4, "cache_hits": 0}
+    assert flights.metrics()["inFlight"] == 0
+
+
+def test_without_ttl_a_finished_read_is_not_reused():
+    async def scenario():
+        flights, query = SingleFlight(), Query()
+        query.release.set()
+        return [await flights.do("forms", query) for _ in range(2)], flights
+
+    results, flights = asyncio.run(scenario())
+    assert results == [1, 2]
+    assert flights.metrics()["cached"] == 0
+
+
+def test_cached_result_expires_after_the_ttl():
+    async def scenario():
+        flights, query = SingleFlight(ttl=0.05), Query()
+        query.release.set()
+        first = await flights.do("forms", query)
+        cached = await flights.do("forms", query)
+        await asyncio.sleep(0.06)
+        expired = await flights.do("forms", query)
+        return flights, [first, cached, expired]
+
+    flights, results = asyncio.run(scenario())
+    assert results == [1, 1, 2]
+    assert flights.stats["cache_hits"] == 1
+    assert flights.stats["executions"] == 2
+
+
+def test_invalidate_detaches_the_in_flight_read():
+    async def scenario():
+        flights, query = SingleFlight(ttl=60), Query()
+        before = asyncio.create_task(flights.do("forms", query))
+        await settle()
+        # A write lands while the first read is still running
+        flights.invalidate()
+        after = asyncio.create_task(flights.do("forms", query))
+        await settle()
+        query.release.set()
+        results = [await before, await after]
+        # The detached flight must not repopulate the cache when it finishes
+        cached = await flights.do("forms", query)
+        return flights, results, cached
+
+    flights, results, cached = asyncio.run(scenario())
+    assert results == [1, 2]
+    assert cached == 2
+    assert flights.stats["coalesced"] == 0
+
+
+def test_cancelling_the_last_waiter_cancels_the_shared_read():
+    async def scenario():
+        flights, query = SingleFlight(), Query()
+        first = asyncio.create_task(flights.do("forms", query))
+        second = asyncio.create_task(flights.do("forms", query))
+        await settle()
+        flight = flights._flights["forms"]
+
+        first.cancel()
+        await settle()
+        # Another caller still waits, so the query keeps running
+        assert not flight.task.done()
+
+        second.cancel()
+        await settle()
+        assert flight.task.cancelled()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+
+        # The next read starts a fresh execution
+        query.release.set()
+        return flights, await flights.do("forms", query)
+
+    flights, result = asyncio.run(scenario())
+    assert result == 2
+    assert flights.metrics()["inFlight"] == 0
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from typing import Any
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import codec
+
+pytestmark = pytest.mark.skipif(not codec.available, reason="msgspec is not installed")
+
+from app import WheelSpecificationCreate, WheelSpecificationCreateStruct  # noqa: E402
+
+
+def as_json(value) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return codec.msgspec.to_builtins(value)
+
+
+def create_app(fast):
+    app = FastAPI()
+    app.router.route_class = codec.CodecRoute
+
+    @app.post("/forms")
+    @codec.decode_body("wheel_spec", WheelSpecificationCreateStruct if fast else None)
+    async def create(wheel_spec: WheelSpecificationCreate):
+        return {"type": type(wheel_spec).__name__, "body": as_json(wheel_spec)}
+
+    return app
+
+
+VALID = {"formNumber": "WHEEL-001", "submittedBy": "Ramesh", "submittedDate": "2025-07-15",
+         "fields": {"wheelGauge": "1600 (+2,-1)"}}
+
+BODIES = [
+    VALID,
+    {**VALID, "formNumber": "  WHEEL-002  ", "submittedBy": " Ramesh "},
+    {**VALID, "extra": "ignored"},
+    {**VALID, "fields": {}},
+    {**VALID, "submittedDate": "2025-07-15T00:00:00"},
+    {**VALID, "submittedDate": "2025-07-15T10:30:00"},
+    {**VALID, "submittedDate": 1752537600},
+    {**VALID, "submittedDate": "15/07/2025"},
+    {**VALID, "submittedDate": None},
+    {**VALID, "formNumber": ""},
+    {**VALID, "formNumber": "   "},
+    {**VALID, "formNumber": "x" * 101},
+    {**VALID, "formNumber": 42},
+    {**VALID, "fields": {"wheelGauge": 1600}},
+    {**VALID, "fields": None},
+    {key: value for key, value in VALID.items() if key != "submittedBy"},
+    {},
+    [],
+    "not an object",
+]
+
+
+def post(app, content):
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/forms", content=content, headers={"Content-Type": "application/json"})
+    return asyncio.run(send())
+
+
+@pytest.mark.parametrize("body", BODIES)
+def test_fast_decode_matches_pydantic(body):
+    content = codec.encode(body)
+    fast, plain = post(create_app(True), content), post(create_app(False), content)
+    assert fast.status_code == plain.status_code
+    if fast.status_code == 200:
+        assert fast.json()["body"] == plain.json()["body"]
+    else:
+        assert fast.json() == plain.json()
+
+
+@pytest.mark.parametrize("content", [b"{", b"", b'{"formNumber": "A",}'])
+def test_malformed_json_matches_pydantic(content):
+    fast, plain = post(create_app(True), content), post(create_app(False), content)
+    assert (fast.status_code, fast.json()) == (plain.status_code, plain.json())
+
+
+def test_valid_body_takes_the_fast_path():
+    response = post(create_app(True), codec.encode(VALID))
+    assert response.json()["type"] == "WheelSpecificationCreateStruct"
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_sync_endpoints_run_in_the_threadpool(fast):
+    app = FastAPI()
+    app.router.route_class = codec.CodecRoute
+    loop_thread = threading.get_ident()
+
+    @app.post("/forms")
+    @codec.decode_body("wheel_spec", WheelSpecificationCreateStruct if fast else None)
+    def create(wheel_spec: WheelSpecificationCreate):
+        return {"type": type(wheel_spec).__name__, "offLoop": threading.get_ident() != loop_thread}
+
+    assert not asyncio.iscoroutinefunction(app.routes[-1].endpoint)
+    response = post(app, codec.encode(VALID))
+    assert response.status_code == 200
+    assert response.json()["offLoop"] is True
+    assert response.json()["type"] == ("WheelSpecificationCreateStruct" if fast else "WheelSpecificationCreate")
@@ -0,0 +1,146 @@
+import asyncio
+import gzip
+
+import pytest
+
+from compressor import CompressionMiddleware, ResponseCompressor, _Gzip, parse_accept_encoding
+
+BODY = b'{"items": [' + b", ".join(b'{"formNumber": "WHEEL-%05d"}' % i for i in range(200)) + b"]}"
+
+
+class Named:
+    def __init__(self, name):
+        self.name = name
+
+
+def negotiator(*names):
+    compressor = ResponseCompressor()
+    compressor.encoders = [Named(name) for name in names]
+    return compressor
+
+
+def selected(compressor, header):
+    encoder = compressor.select_encoder(header)
+    return encoder and encoder.name
+
+
+def test_parse_accept_encoding_reads_q_values():
+    assert parse_accept_encoding("gzip, br;q=0.5, ZSTD ;q=0.8, identity;q=0, *;q=0.1") == {
+        "gzip": 1.0, "br": 0.5, "zstd": 0.8, "identity": 0.0, "*": 0.1,
+    }
+    assert parse_accept_encoding("gzip;q=bogus, ,br") == {"gzip": 0.0, "br": 1.0}
+    assert parse_accept_encoding("") == {}
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, br, zstd", "zstd"),
+    ("gzip, br;q=0.9", "gzip"),
+    ("gzip;q=0.5, br;q=0.7", "br"),
+    ("gzip;q=0", None),
+    ("identity;q=0", None),
+    ("identity", None),
+    ("*", "zstd"),
+    ("*;q=0.5, zstd;q=0", "br"),
+    ("*;q=0", None),
+    ("deflate", None),
+])
+def test_select_encoder_honours_client_weights(header, expected):
+    assert selected(negotiator("zstd", "br", "gzip"), header) == expected
+
+
+def test_select_encoder_only_offers_installed_codings():
+    assert selected(negotiator("gzip"), "zstd, br") is None
+    assert selected(negotiator("gzip"), "zstd, br, gzip;q=0.1") == "gzip"
+
+
+def test_compress_serves_repeated_bodies_from_the_cache():
+    compressor = ResponseCompressor()
+    encoder = _Gzip(6)
+    first = compressor.compress(encoder, BODY)
+    second = compressor.compress(encoder, BODY)
+    assert second is first
+    assert gzip.decompress(first) == BODY
+    compressor.compress(encoder, BODY + b" ")
+    assert compressor.stats["cache_hits"] == 1
+    assert compressor.metrics()["cacheEntries"] == 2
+
+
+def test_cache_evicts_least_recently_used_bodies():
+    encoder = _Gzip(6)
+    size = len(encoder.compress(BODY))
+    compressor = ResponseCompressor(cache_bytes=size * 2)
+    bodies = [BODY + bytes([i]) for i in range(3)]
+    for body in bodies:
+        compressor.compress(encoder, body)
+    assert compressor.metrics()["cacheBytes"] <= size * 2
+    compressor.compress(encoder, bodies[0])
+    assert compressor.stats["cache_hits"] == 0
+
+
+def respond(compressor, accept_encoding, chunks, content_type=b"application/json"):
+    """Run one request through the middleware; returns (start, [body messages])"""
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type), (b"etag", b'"v1"'),
+                                (b"content-length", str(sum(map(len, chunks))).encode())]})
+        for index, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk,
+                        "more_body": index < len(chunks) - 1})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding)]}
+    asyncio.run(CompressionMiddleware(app, compressor)(scope, None, send))
+    return dict(sent[0]["headers"]), sent[1:]
+
+
+def test_small_bodies_are_sent_uncompressed():
+    compressor = ResponseCompressor(minimum_size=1024)
+    headers, bodies = respond(compressor, b"gzip", [b'{"ok": true}'])
+    assert b"content-encoding" not in headers
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert bodies[0]["body"] == b'{"ok": true}'
+    assert compressor.stats["skipped_small"] == 1
+
+
+def test_whole_bodies_are_compressed_with_a_weak_etag():
+    compressor = ResponseCompressor(minimum_size=1024)
+    headers, bodies = respond(compressor, b"gzip", [BODY])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"etag"] == b'W/"v1"'
+    assert int(headers[b"content-length"]) == len(bodies[0]["body"])
+    assert gzip.decompress(bodies[0]["body"]) == BODY
+
+
+def test_identity_only_clients_get_the_body_as_is():
+    compressor = ResponseCompressor(minimum_size=0)
+    headers, bodies = respond(compressor, b"gzip;q=0, identity", [BODY])
+    assert b"content-encoding" not in headers
+    assert headers[b"etag"] == b'"v1"'
+    assert bodies[0]["body"] == BODY
+
+
+def test_streamed_bodies_are_compressed_chunk_by_chunk():
+    compressor = ResponseCompressor(minimum_size=1024)
+    compressor.encoders = [_Gzip(6)]
+    chunks = [BODY[:10], BODY[10:500], BODY[500:]]
+    headers, bodies = respond(compressor, b"gzip", chunks, content_type=b"application/x-ndjson")
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"content-length" not in headers
+    assert [message["more_body"] for message in bodies] == [True, True, False]
+    # Every chunk is flushed, so a reader can decode it as it arrives
+    assert all(message["body"] for message in bodies)
+    assert gzip.decompress(b"".join(message["body"] for message in bodies)) == BODY
+    assert compressor.stats["streamed"] == 1
+    assert compressor.stats["cache_hits"] == 0
+
+
+def test_incompressible_types_pass_through():
+    compressor = ResponseCompressor(minimum_size=0)
+    headers, bodies = respond(compressor, b"gzip", [BODY], content_type=b"image/png")
+    assert b"content-encoding" not in headers
+    assert b"vary" not in headers
+    assert bodies[0]["body"] == BODY
@@ -0,0 +1,57 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app import etag_for, parse_if_match
+
+FORMS = "/api/forms/wheel-specifications"
+
+FORM = {"formNumber": "WHEEL-001", "submittedBy": "Ramesh", "submittedDate": "2025-07-15",
+        "fields": {"wheelGauge": "1600 (+2,-1)"}}
+
+UPDATED_AT = datetime(2025, 7, 15, 10, 30, 0, 123456, tzinfo=timezone.utc)
+
+
+def test_etag_round_trips_through_if_match():
+    etag = etag_for(UPDATED_AT)
+    assert etag == '"1752575400123456"'
+    assert parse_if_match(etag) == UPDATED_AT
+    assert parse_if_match(f" {etag} ") == UPDATED_AT
+
+
+def test_weak_etag_matches_if_match():
+    # The compression middleware weakens the ETag of a compressed body
+    assert parse_if_match(f"W/{etag_for(UPDATED_AT)}") == UPDATED_AT
+
+
+@pytest.mark.parametrize("if_match", [None, "*", " * "])
+def test_missing_or_wildcard_if_match_is_unconditional(if_match):
+    assert parse_if_match(if_match) is None
+
+
+@pytest.mark.parametrize("if_match", ['"abc"', "W/", '"1", "2"'])
+def test_unparseable_if_match_fails_the_precondition(if_match):
+    with pytest.raises(HTTPException) as failed:
+        parse_if_match(if_match)
+    assert failed.value.status_code == 412
+
+
+def test_patch_with_a_stale_etag_is_rejected_with_412(api):
+    async def scenario(client):
+        await client.post(FORMS, json=FORM)
+        read = await client.get(f"{FORMS}/WHEEL-001")
+        etag = read.headers["etag"]
+        first = await client.patch(f"{FORMS}/WHEEL-001", json={"submittedBy": "Suresh"},
+                                   headers={"If-Match": f"W/{etag}"})
+        stale = await client.patch(f"{FORMS}/WHEEL-001", json={"submittedBy": "Mahesh"},
+                                   headers={"If-Match": etag})
+        current = await client.get(f"{FORMS}/WHEEL-001")
+        return etag, first, stale, current
+
+    etag, first, stale, current = api(scenario)
+    assert first.status_code == 200
+    assert first.headers["etag"] != etag
+    assert stale.status_code == 412
+    assert current.json()["data"]["submittedBy"] == "Suresh"
+    assert current.headers["etag"] == first.headers["etag"]
@@ -0,0 +1,59 @@
+import pytest
+from fastapi import HTTPException
+
+from app import build_projection
+from storage import Projection
+
+FORMS = "/api/forms/wheel-specifications"
+
+FORM = {"formNumber": "WHEEL-001", "submittedBy": "Ramesh", "submittedDate": "2025-07-15",
+        "fields": {"wheelGauge": "1600 (+2,-1)", "wheelProfile": "29.4 Flange Thickness"}}
+
+
+def test_no_projection_reads_every_column():
+    assert build_projection(None, None) is None
+    assert build_projection("", " , ") is None
+
+
+def test_top_level_keys_map_to_columns():
+    assert build_projection("formNumber, submittedBy,updatedAt") == Projection(
+        ("form_number", "submitted_by", "updated_at"), ()
+    )
+
+
+def test_nested_fields_keys_select_single_measurements():
+    assert build_projection("formNumber,fields.wheelGauge,fields.wheelProfile") == Projection(
+        ("form_number",), ("wheelGauge", "wheelProfile")
+    )
+
+
+def test_include_and_fields_alias_are_merged_without_duplicates():
+    assert build_projection("formNumber,fields.wheelGauge", "fields.wheelGauge,formNumber,fields") == Projection(
+        ("form_number", "fields"), ("wheelGauge",)
+    )
+
+
+@pytest.mark.parametrize("projection", ["password", "fields.bogus", "fields.", "form_number", "fields.*"])
+def test_unknown_keys_are_rejected(projection):
+    with pytest.raises(HTTPException) as rejected:
+        build_projection(f"formNumber,{projection}")
+    assert rejected.value.status_code == 400
+    assert "Unknown field" in rejected.value.detail
+
+
+def test_projected_read_returns_only_the_requested_measurements(api):
+    async def scenario(client):
+        await client.post(FORMS, json=FORM)
+        only_gauge = await client.get(f"{FORMS}/WHEEL-001", params={"include": "formNumber,fields.wheelGauge"})
+        everything = await client.get(f"{FORMS}/WHEEL-001", params={"fields": "fields,fields.wheelGauge"})
+        listed = await client.get(FORMS, params={"include": "fields.wheelProfile"})
+        unknown = await client.get(f"{FORMS}/WHEEL-001", params={"include": "fields.bogus"})
+        return only_gauge, everything, listed, unknown
+
+    only_gauge, everything, listed, unknown = api(scenario)
+    assert only_gauge.json()["data"] == {"formNumber": "WHEEL-001", "fields": {"wheelGauge": "1600 (+2,-1)"}}
+    # Without updatedAt there is no version to report
+    assert "etag" not in only_gauge.headers
+    assert everything.json()["data"]["fields"]["wheelProfile"] == "29.4 Flange Thickness"
+    assert listed.json()["data"][0] == {"fields": {"wheelProfile": "29.4 Flange Thickness"}}
+    assert unknown.status_code == 400
@@ -0,0 +1,30 @@
+from serve import size_pools
+
+SHARDS = {
+    "s0": "postgresql://u:p@db1:5432/api_s0",
+    "s1": "postgresql://u:p@db1:5432/api_s1",
+    "s2": "postgresql://u:p@db2/api_s2",
+}
+
+
+def test_size_pools_leaves_a_health_connection_per_worker_and_shard():
+    # 4 workers on one server: each holds a pool plus one prober connection
+    budget = size_pools({"default": "postgresql://u:p@db1:5432/api"}, {("db1", 5432): 100}, 4, 10)
+    assert budget == 17
+    assert 4 * (budget + 1) <= 100 - 10
+
+
+def test_size_pools_leaves_room_for_a_worker_overlapping_a_restart():
+    budget = size_pools({"default": "postgresql://u:p@db1:5432/api"}, {("db1", 5432): 100}, 4, 10)
+    # During a SIGHUP restart a fifth worker runs until the one it replaces exits
+    assert (4 + 1) * (budget + 1) <= 100 - 10
+
+
+def test_size_pools_takes_the_tightest_server():
+    budgets = {("db1", 5432): 197, ("db2", 5432): 100}
+    # db1 hosts two shards: (197 - 10) // (4 * 2) - 1 = 22; db2: (100 - 10) // 4 - 1 = 21
+    assert size_pools(SHARDS, budgets, 3, 10) == 21
+
+
+def test_size_pools_reports_no_room():
+    assert size_pools({"default": "postgresql://u:p@db1/api"}, {("db1", 5432): 20}, 8, 10) < 1
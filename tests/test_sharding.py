@@ -0,0 +1,47 @@
+from sharding import DEFAULT_SHARD, HashRing, merge_sorted, parse_shard_urls
+
+KEYS = [f"WHEEL-{i:05d}" for i in range(10000)]
+
+
+def test_shard_for_is_stable_and_ignores_shard_order():
+    ring = HashRing(["s0", "s1", "s2"])
+    placement = [ring.shard_for(key) for key in KEYS]
+    assert placement == [ring.shard_for(key) for key in KEYS]
+    assert placement == [HashRing(["s2", "s0", "s1"]).shard_for(key) for key in KEYS]
+    assert set(placement) == {"s0", "s1", "s2"}
+
+
+def test_single_shard_owns_every_key():
+    ring = HashRing([DEFAULT_SHARD])
+    assert {ring.shard_for(key) for key in KEYS} == {DEFAULT_SHARD}
+
+
+def test_adding_a_shard_only_moves_keys_to_it():
+    before = HashRing(["s0", "s1", "s2"])
+    after = HashRing(["s0", "s1", "s2", "s3"])
+    moved = [key for key in KEYS if before.shard_for(key) != after.shard_for(key)]
+    assert {after.shard_for(key) for key in moved} == {"s3"}
+    # The new shard takes roughly a quarter of the keys
+    assert 0.15 < len(moved) / len(KEYS) < 0.35
+
+
+def test_merge_sorted_interleaves_descending_shard_results():
+    shards = [[9, 6, 2], [8, 7, 1], [5, 4, 3]]
+    assert merge_sorted(shards, lambda value: value, limit=10) == [9, 8, 7, 6, 5, 4, 3, 2, 1]
+    assert merge_sorted(shards, lambda value: value, limit=3, offset=2) == [7, 6, 5]
+    assert merge_sorted(shards, lambda value: value, limit=5, offset=8) == [1]
+    assert merge_sorted([[], []], lambda value: value, limit=5) == []
+
+
+def test_merge_sorted_keeps_ties_in_shard_order():
+    shards = [[(2, "s0-a"), (1, "s0-b")], [(2, "s1-a"), (1, "s1-b")]]
+    page = merge_sorted(shards, lambda row: row[0], limit=4)
+    assert [name for _, name in page] == ["s0-a", "s1-a", "s0-b", "s1-b"]
+
+
+def test_parse_shard_urls():
+    assert parse_shard_urls(None, "postgresql://db/api") == {DEFAULT_SHARD: "postgresql://db/api"}
+    assert parse_shard_urls("a=postgresql://db1/api, postgresql://db2/api", "unused") == {
+        "a": "postgresql://db1/api",
+        "shard1": "postgresql://db2/api",
+    }
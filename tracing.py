@@ -0,0 +1,399 @@
+"""
+Request tracing with W3C trace context and OTLP/JSON export.
+
+TracingMiddleware opens a server span per request, continuing the trace from
+an incoming `traceparent` header or starting a new one, and returns the trace
+in a `traceresponse` header. Code under the request opens child spans with
+`tracing.span(name, **attributes)`; the current span lives in a context
+variable, so spans nest across awaits and tasks without being passed around.
+
+Sampling is decided once per trace at its head: an incoming sampled flag is
+honoured, otherwise a fixed ratio of trace IDs is kept. Spans of unsampled
+requests are never created, so they cost one context-variable lookup each.
+
+Finished spans are buffered and exported in batches from a background task,
+as OTLP/JSON: appended one request per line to a file, or POSTed to an
+OpenTelemetry collector's /v1/traces endpoint.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import time
+import urllib.request
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds and status codes
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "kind", "sampled",
+                 "attributes", "start_ns", "_started", "end_ns", "error", "phase_started", "serializing",
+                 "_cpu_started", "cpu_ns")
+
+    def __init__(self, tracer, trace_id, parent_id, name, kind=KIND_INTERNAL, sampled=True, attributes=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter_ns()
+        self._cpu_started = time.thread_time_ns()
+        self.end_ns = None
+        # Thread CPU time while the span was open (includes interleaved tasks)
+        self.cpu_ns = 0
+        self.error = None
+        # Start of the current request phase (server spans only)
+        self.phase_started = self._started
+        self.serializing = False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end_phase(self, name):
+        """Record a child span from the previous phase boundary until now"""
+        now = time.perf_counter_ns()
+        phase = Span(self.tracer, self.trace_id, self.span_id, name)
+        phase.start_ns = self.start_ns + (self.phase_started - self._started)
+        phase.end(self.start_ns + (now - self._started))
+        self.phase_started = now
+
+    def end(self, end_ns=None):
+        """Finish the span (again is a no-op) and queue it for export"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or self.start_ns + (time.perf_counter_ns() - self._started)
+        self.cpu_ns = time.thread_time_ns() - self._cpu_started
+        if self.sampled:
+            self.tracer.queue(self)
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+class _NoopSpan:
+    sampled = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self, end_ns=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span():
+    return _current.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Child span of the current span for the duration of the block, if it is sampled"""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        yield NOOP_SPAN
+        return
+    child = Span(parent.tracer, parent.trace_id, parent.span_id, name, attributes=attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+def start_span(name, **attributes):
+    """Child span of the current span that the caller ends; it does not become current"""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return NOOP_SPAN
+    return Span(parent.tracer, parent.trace_id, parent.span_id, name, attributes=attributes)
+
+
+class _Collector:
+    def __init__(self):
+        self.spans = []
+
+    def queue(self, span):
+        self.spans.append(span)
+
+
+@contextmanager
+def collect(name):
+    """Record every span of the enclosed work into a list, whether or not it is sampled.
+
+    The spans stay local (they are not exported); the list is complete once
+    the block exits.
+    """
+    parent = _current.get()
+    collector = _Collector()
+    if parent is not None:
+        root = Span(collector, parent.trace_id, parent.span_id, name)
+    else:
+        root = Span(collector, os.urandom(16).hex(), None, name)
+    token = _current.set(root)
+    try:
+        yield collector.spans
+    finally:
+        _current.reset(token)
+        root.end()
+
+
+def traced_endpoint(endpoint):
+    """Wrap a route endpoint so a sampled request records three phases.
+
+    `request.parse` runs from the start of the request to the endpoint call
+    (parameter parsing and body validation), `endpoint` is the call itself and
+    `response.serialize` runs from its return until the response starts
+    (response_model validation and JSON encoding), recorded by the middleware.
+    A plain `def` endpoint gets a plain `def` wrapper, so FastAPI still runs
+    it in its threadpool rather than on the event loop.
+    """
+    if not asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        def traced_sync(*args, **kwargs):
+            server = _current.get()
+            if server is None or not server.sampled:
+                return endpoint(*args, **kwargs)
+            server.end_phase("request.parse")
+            with span("endpoint", **{"code.function": endpoint.__name__}):
+                result = endpoint(*args, **kwargs)
+            server.phase_started = time.perf_counter_ns()
+            server.serializing = True
+            return result
+        return traced_sync
+
+    @functools.wraps(endpoint)
+    async def traced(*args, **kwargs):
+        server = _current.get()
+        if server is None or not server.sampled:
+            return await endpoint(*args, **kwargs)
+        server.end_phase("request.parse")
+        with span("endpoint", **{"code.function": endpoint.__name__}):
+            result = await endpoint(*args, **kwargs)
+        server.phase_started = time.perf_counter_ns()
+        server.serializing = True
+        return result
+    return traced
+
+
+def statement_logger(record):
+    """asyncpg query logger: records each executed statement as a child span"""
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return
+    statement = Span(
+        parent.tracer, parent.trace_id, parent.span_id, "db.statement", kind=KIND_CLIENT,
+        attributes={"db.system": "postgresql", "db.statement": " ".join(record.query.split())}
+    )
+    # The logger runs once the statement has finished
+    ended = statement.start_ns
+    statement.start_ns = ended - int(record.elapsed * 1e9)
+    if record.exception is not None:
+        statement.record_error(record.exception)
+    statement.end(ended)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span):
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    if span.error:
+        encoded["status"] = {"code": STATUS_ERROR, "message": span.error}
+    return encoded
+
+
+class FileExporter:
+    """Appends one OTLP/JSON ExportTraceServiceRequest per line"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, payload):
+        line = json.dumps(payload, separators=(",", ":")) + "\n"
+        # One append per batch keeps lines from several workers intact
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class OTLPHTTPExporter:
+    """POSTs OTLP/JSON to an OpenTelemetry collector"""
+
+    def __init__(self, endpoint, timeout=5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+
+    def export(self, payload):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload, separators=(",", ":")).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def exporter_for(target):
+    """Exporter for TRACE_EXPORT: a collector URL or a file path"""
+    if target.startswith(("http://", "https://")):
+        return OTLPHTTPExporter(target)
+    return FileExporter(target[len("file://"):] if target.startswith("file://") else target)
+
+
+class Tracer:
+    def __init__(self, exporter, sample_ratio=0.01, service_name="wheel-specifications-api",
+                 max_queue=10000, export_interval=5.0):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        # Trace IDs whose low 64 bits fall below this are sampled
+        self.sample_bound = int(sample_ratio * (1 << 64))
+        self.resource = {"attributes": [
+            {"key": "service.name", "value": {"stringValue": service_name}},
+            {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+        ]}
+        self.max_queue = max_queue
+        self.export_interval = export_interval
+        self._queue = []
+        self.stats = {"traces": 0, "sampled": 0, "spans": 0, "dropped": 0, "export_errors": 0}
+
+    def start_trace(self, traceparent, name, attributes):
+        """Server span continuing `traceparent` (when valid) or starting a new trace"""
+        match = _TRACEPARENT.match(traceparent or "")
+        if match and match.group(1) != "0" * 32 and match.group(2) != "0" * 16:
+            trace_id, parent_id = match.group(1), match.group(2)
+            sampled = bool(int(match.group(3), 16) & 1)
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = int(trace_id[16:], 16) < self.sample_bound
+        self.stats["traces"] += 1
+        if sampled:
+            self.stats["sampled"] += 1
+        return Span(self, trace_id, parent_id, name, kind=KIND_SERVER, sampled=sampled, attributes=attributes)
+
+    def queue(self, span):
+        if len(self._queue) >= self.max_queue:
+            self.stats["dropped"] += 1
+            return
+        self._queue.append(span)
+        self.stats["spans"] += 1
+
+    async def flush(self):
+        """Export every queued span in one request, off the event loop"""
+        if not self._queue:
+            return
+        spans, self._queue = self._queue, []
+        payload = {"resourceSpans": [{
+            "resource": self.resource,
+            "scopeSpans": [{"scope": {"name": "app"}, "spans": [_otlp_span(s) for s in spans]}],
+        }]}
+        try:
+            await asyncio.to_thread(self.exporter.export, payload)
+        except Exception as e:
+            self.stats["export_errors"] += 1
+            logger.warning(f"Exporting {len(spans)} spans failed: {e}")
+
+    async def export_loop(self):
+        """Flush queued spans every export_interval seconds, and once more when cancelled"""
+        try:
+            while True:
+                await asyncio.sleep(self.export_interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    def metrics(self):
+        return {"sampleRatio": self.sample_ratio, "queued": len(self._queue), **self.stats}
+
+
+class TracingMiddleware:
+    def __init__(self, app, tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1").strip().lower()
+        server = self.tracer.start_trace(
+            traceparent, f"{scope['method']} {scope['path']}",
+            {"http.request.method": scope["method"], "url.path": scope["path"]}
+        )
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                if server.serializing:
+                    server.end_phase("response.serialize")
+                server.set_attribute("http.response.status_code", message["status"])
+                if message["status"] >= 500:
+                    server.error = f"HTTP {message['status']}"
+                message = {**message, "headers": [
+                    *message.get("headers", []), (b"traceresponse", server.traceparent.encode("latin-1"))
+                ]}
+            await send(message)
+
+        token = _current.set(server)
+        try:
+            await self.app(scope, receive, send_traced)
+        except BaseException as e:
+            server.record_error(e)
+            raise
+        finally:
+            _current.reset(token)
+            # Name the span after the matched route template, not the raw path
+            route = scope.get("route")
+            if route is not None and hasattr(route, "path"):
+                server.name = f"{scope['method']} {route.path}"
+                server.set_attribute("http.route", route.path)
+            server.end()